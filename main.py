@@ -3,20 +3,25 @@ import multiprocessing as mp
 import os
 import time
 from multiprocessing.context import Process
+from typing import Callable, List
 
 import cv2
 from loguru import logger
 
 from text_renderer.config import get_cfg, GeneratorCfg
-from text_renderer.dataset import LmdbDataset, ImgDataset
+from text_renderer.dataset import DATASETS, ShardedDataset, encode_jpg
+from text_renderer.effect import record_applied_effects
 from text_renderer.render import Render
+from text_renderer.utils.errors import PanicError
 
 cv2.setNumThreads(1)
 
 STOP_TOKEN = "kill"
 
-# each child process will initialize Render in process_setup
+# each child process will initialize Render, data_queue and encode_in_worker in process_setup
 render: Render
+data_queue = None
+encode_in_worker: bool = False
 
 
 class DBWriterProcess(Process):
@@ -26,19 +31,31 @@ class DBWriterProcess(Process):
         data_queue,
         generator_cfg: GeneratorCfg,
         log_period: float = 1,
+        shard_id: int = None,
+        num_shards: int = 1,
     ):
+        """
+        If shard_id is not None, images are saved in shard directory of save_dir,
+        data_queue is shared by num_shards DBWriterProcess.
+        """
         super().__init__()
         self.dataset_cls = dataset_cls
         self.data_queue = data_queue
         self.generator_cfg = generator_cfg
         self.log_period = log_period
+        self.shard_id = shard_id
+        self.num_shards = num_shards
 
     def run(self):
         num_image = self.generator_cfg.num_image
         save_dir = self.generator_cfg.save_dir
+        if self.shard_id is not None:
+            # each shard receives about num_image / num_shards images
+            num_image = max(1, num_image // self.num_shards)
+            save_dir = os.path.join(save_dir, ShardedDataset.shard_dir(self.shard_id))
         log_period = max(1, int(self.log_period / 100 * num_image))
         try:
-            with self.dataset_cls(str(save_dir)) as db:
+            with self.dataset_cls(str(save_dir), **self.generator_cfg.dataset_kwargs) as db:
                 exist_count = db.read_count()
                 count = 0
                 logger.info(f"Exist image count in {save_dir}: {exist_count}")
@@ -50,7 +67,12 @@ class DBWriterProcess(Process):
                         break
 
                     name = "{:09d}".format(exist_count + count)
-                    db.write(name, m["image"], m["label"])
+                    if "image_bytes" in m:
+                        db.write_bytes(
+                            name, m["image_bytes"], m["label"], m["size"], m.get("meta")
+                        )
+                    else:
+                        db.write(name, m["image"], m["label"], m.get("meta"))
                     count += 1
                     if count % log_period == 0:
                         logger.info(
@@ -58,6 +80,8 @@ class DBWriterProcess(Process):
                         )
                         start = time.time()
                 db.write_count(count + exist_count)
+                if self.shard_id is None and count != num_image:
+                    logger.warning(f"Expect {num_image} images but {count} were written")
                 logger.info(f"{(count / num_image) * 100:.2f}%({count}/{num_image})")
                 logger.info(f"Finish generate: {count}. Total: {exist_count+count}")
         except Exception as e:
@@ -65,65 +89,237 @@ class DBWriterProcess(Process):
             raise e
 
 
-def generate_img(data_queue):
-    data = render()
-    if data is not None:
-        data_queue.put({"image": data[0], "label": data[1]})
+def generate_img() -> bool:
+    """
+    Render one image and put it into data_queue
+
+    Returns:
+        True if the image is sent to DBWriterProcess
+    """
+    try:
+        font_text = render.render_config.corpus.sample()
+        with record_applied_effects() as effects:
+            data = render(font_text)
+    except Exception:
+        logger.exception("Render image failed")
+        return False
+
+    if data is None:
+        return False
+
+    image, label = data
+    meta = {
+        "font_path": font_text.font_path,
+        "font_size": font_text.font.size,
+        "effects": effects,
+    }
+    if encode_in_worker:
+        height, width = image.shape[:2]
+        data_queue.put(
+            {
+                "image_bytes": encode_jpg(image),
+                "label": label,
+                "size": (width, height),
+                "meta": meta,
+            }
+        )
+    else:
+        data_queue.put({"image": image, "label": label, "meta": meta})
+    return True
+
+
+def generate_imgs(indexes: List[int]) -> List[int]:
+    """
+    Render a chunk of samples
+
+    Args:
+        indexes: sample indexes of this chunk
+
+    Returns:
+        indexes of samples failed to render, they should be dispatched again
+    """
+    return [i for i in indexes if not generate_img()]
+
+
+def dispatch(
+    map_func: Callable, num_image: int, chunk_size: int, max_retries: int
+) -> List[int]:
+    """
+    Hand chunks of sample indexes to map_func until all samples are rendered
+
+    Args:
+        map_func: map(func, iterable) like function, e.g. Pool.imap_unordered
+        num_image: number of samples to render
+        chunk_size: number of sample indexes in each task
+        max_retries: how many times failed samples are dispatched again
+
+    Returns:
+        indexes of samples still failed after max_retries
+    """
+    pending = list(range(num_image))
+    for retry_count in range(max_retries + 1):
+        if len(pending) == 0:
+            break
+
+        if retry_count != 0:
+            logger.warning(
+                f"Retry {len(pending)} failed samples ({retry_count}/{max_retries})"
+            )
+
+        chunks = [
+            pending[i : i + chunk_size] for i in range(0, len(pending), chunk_size)
+        ]
+        failed = []
+        for chunk_failed in map_func(generate_imgs, chunks):
+            failed.extend(chunk_failed)
+        pending = failed
+
+    if len(pending) != 0:
+        logger.error(f"{len(pending)} samples failed after {max_retries} retries")
+    return pending
 
 
 def process_setup(*args):
-    global render
+    global render, data_queue, encode_in_worker
     import numpy as np
 
     # Make sure different process has different random seed
     np.random.seed()
 
     render = Render(args[0])
+    data_queue = args[1]
+    encode_in_worker = args[2]
     logger.info(f"Finish setup image generate process: {os.getpid()}")
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", required=True, help="python file path")
-    parser.add_argument("--dataset", default="img", choices=["lmdb", "img"])
+    parser.add_argument("--dataset", default="img", choices=list(DATASETS))
     parser.add_argument("--num_processes", type=int, default=2)
+    parser.add_argument(
+        "--num_writers",
+        type=int,
+        default=1,
+        help="number of DBWriterProcess, each one writes a shard of the dataset",
+    )
+    parser.add_argument(
+        "--encode_in_worker",
+        action="store_true",
+        help="encode jpg in render processes, only send compressed bytes to DBWriterProcess. Not for --dataset packed",
+    )
+    parser.add_argument(
+        "--transport",
+        default="queue",
+        choices=["queue", "shm"],
+        help="shm: pass images to DBWriterProcess through shared memory slots, requires Python >= 3.8",
+    )
+    parser.add_argument(
+        "--shm_slots",
+        type=int,
+        default=256,
+        help="number of shared memory slots, only used when --transport shm",
+    )
+    parser.add_argument(
+        "--shm_slot_width",
+        type=int,
+        default=1024,
+        help="max image width fit in a slot, wider images are sent through the queue",
+    )
     parser.add_argument("--log_period", type=float, default=10)
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=100,
+        help="number of samples dispatched to a render process at once",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="how many times failed samples are dispatched again",
+    )
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     mp.set_start_method("spawn", force=True)
     manager = mp.Manager()
-    data_queue = manager.Queue()
+    manager_queue = manager.Queue()
     args = parse_args()
 
-    dataset_cls = LmdbDataset if args.dataset == "lmdb" else ImgDataset
+    dataset_cls = DATASETS[args.dataset]
+    if args.encode_in_worker and args.dataset == "packed":
+        # packed dataset stores raw pixels, jpg would be decoded back with its loss
+        raise PanicError("--encode_in_worker can't be used with --dataset packed")
 
     generator_cfgs = get_cfg(args.config)
 
     for generator_cfg in generator_cfgs:
-        db_writer_process = DBWriterProcess(
-            dataset_cls, data_queue, generator_cfg, args.log_period
-        )
-        db_writer_process.start()
+        render_cfg = generator_cfg.render_cfg
+        if render_cfg.corpus is None:
+            raise PanicError(f"RenderCfg.corpus is not set: {generator_cfg.save_dir}")
+
+        if args.transport == "shm":
+            from text_renderer.shm_queue import SharedMemoryQueue
+
+            if render_cfg.height == -1:
+                raise PanicError("--transport shm requires RenderCfg.height != -1")
+            channels = 1 if render_cfg.gray else 3
+            queue = SharedMemoryQueue(
+                args.shm_slots, render_cfg.height * args.shm_slot_width * channels
+            )
+        else:
+            queue = manager_queue
+
+        if args.num_writers > 1:
+            db_writer_processes = [
+                DBWriterProcess(
+                    dataset_cls,
+                    queue,
+                    generator_cfg,
+                    args.log_period,
+                    shard_id=i,
+                    num_shards=args.num_writers,
+                )
+                for i in range(args.num_writers)
+            ]
+        else:
+            db_writer_processes = [
+                DBWriterProcess(dataset_cls, queue, generator_cfg, args.log_period)
+            ]
+        for p in db_writer_processes:
+            p.start()
+        if args.transport == "shm":
+            queue.watch_readers(db_writer_processes)
 
         if args.num_processes == 0:
-            process_setup(generator_cfg.render_cfg)
-            for _ in range(generator_cfg.num_image):
-                generate_img(data_queue)
-            data_queue.put(STOP_TOKEN)
-            db_writer_process.join()
+            process_setup(render_cfg, queue, args.encode_in_worker)
+            dispatch(map, generator_cfg.num_image, args.chunk_size, args.max_retries)
         else:
             with mp.Pool(
                 processes=args.num_processes,
                 initializer=process_setup,
-                initargs=(generator_cfg.render_cfg,),
+                initargs=(render_cfg, queue, args.encode_in_worker),
             ) as pool:
-                for _ in range(generator_cfg.num_image):
-                    pool.apply_async(generate_img, args=(data_queue,))
-
+                dispatch(
+                    pool.imap_unordered,
+                    generator_cfg.num_image,
+                    args.chunk_size,
+                    args.max_retries,
+                )
+                # let render processes exit normally (instead of terminate() in __exit__),
+                # so they close their handles of SharedMemoryQueue
                 pool.close()
                 pool.join()
 
-            data_queue.put(STOP_TOKEN)
-            db_writer_process.join()
+        for p in db_writer_processes:
+            queue.put(STOP_TOKEN)
+        for p in db_writer_processes:
+            p.join()
+
+        if args.num_writers > 1:
+            total = ShardedDataset.write_manifest(str(generator_cfg.save_dir), args.dataset)
+            logger.info(f"Total image count of all shards: {total}")
+        if args.transport == "shm":
+            queue.close()
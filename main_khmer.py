@@ -28,6 +28,10 @@ FONT_LIST_DIR   = DATA_DIR / "font_list"
 TEXT_DIR        = DATA_DIR / "text"
 ENUM_DIR        = TEXT_DIR / 'khm'
 ENUM_ZIP_DIR    = TEXT_DIR / 'khm_7z'
+# bytes of images kept in memory before DBMemoryWriter spills to disk
+MEMORY_BUDGET   = 1 << 30
+# bytes of rendered Khmer clusters cached by KhmerTextRender
+CLUSTER_CACHE_SIZE = 64 * 1024 * 1024
 
 
 class KhmerEnumCorpus(EnumCorpus):
@@ -86,12 +90,12 @@ class TextGenerator:
             
             corpus = KhmerEnumCorpus(text_file, CHAR_DIR / 'khm.txt')
             # corpus = self.get_khmer_enum_corpus(text_file)
-            render = KhmerTextRender(BG_DIR)
+            render = KhmerTextRender(BG_DIR, cluster_cache_size=CLUSTER_CACHE_SIZE)
             line_count = corpus.count()
             
             # self.db_writers = [DBFileWriter(render, save_dir, f'labels_{i}.json')  for i in range(num_job)]
             
-            self.db_memory = DBMemoryWriter(render)
+            self.db_memory = DBMemoryWriter(render, memory_budget=MEMORY_BUDGET)
             
             # count = 0
             # self._gen(render, db, corpus, count, history)
@@ -111,6 +115,8 @@ class TextGenerator:
                 offset += num_image
                 if file_offset % num_image ==0:
                     print(file_offset)
+
+            logger.info(f"{f} cluster cache: {render.cluster_cache.stats()}")
     
     
     
@@ -10,4 +10,6 @@ setup(
     description="",
     packages=find_packages(),
     python_requires=">=3.6",
+    # font.getbbox/getlength
+    install_requires=["Pillow>=8.0.0"],
 )
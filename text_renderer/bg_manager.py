@@ -1,6 +1,7 @@
+import math
 from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, NamedTuple, Tuple
 
 import numpy as np
 from PIL import Image
@@ -12,11 +13,205 @@ from text_renderer.utils.utils import random_choice
 IMAGE_EXTENSIONS = {".jpeg", ".jpg", ".JPG", ".JPEG", ".PNG", ".png", ".bmp", ".BMP"}
 
 
+def _integral_image(np_img: np.ndarray, dtype) -> np.ndarray:
+    """
+    (h, w, ...) -> (h + 1, w + 1, ...) integral image.
+    Unsigned sums wrap around, region sums are still exact if they fit in dtype.
+    """
+    integral = np.zeros((np_img.shape[0] + 1, np_img.shape[1] + 1) + np_img.shape[2:], dtype=dtype)
+    np.cumsum(np_img, axis=0, dtype=dtype, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, dtype=dtype, out=integral[1:, 1:])
+    return integral
+
+
+def _region_sum(integral: np.ndarray, box: Tuple[int, int, int, int]):
+    left, top, right, bottom = box
+    corners = integral[[bottom, top, bottom, top], [right, right, left, left]]
+    # wrap around of array ops is silent, unlike numpy scalar ops
+    return (corners[0:1] - corners[1:2] - corners[2:3] + corners[3:4])[0]
+
+
+class BgStats:
+    """
+    Statistics of a background image, so text color and text position can be chosen from
+    the region text is pasted on without reading the image again. Each statistic is
+    computed on first use and kept with the background, nothing is computed if no config
+    reads them.
+
+    Region statistics are computed on a grid of cell_size x cell_size cells, regions are
+    snapped to the nearest cell borders. Integral images take 16 bytes per cell for
+    luminance and 8 bytes per cell per color channel (only if region_mean is used on color
+    images), e.g. 2.7 MB for a 2400x1800 color image with cell_size 8.
+    """
+
+    def __init__(self, pil_img: PILImage, cell_size: int = 8):
+        """
+
+        Parameters
+        ----------
+        pil_img : PILImage
+            L or RGBA background image, kept to compute statistics on first use
+        cell_size : int
+            Pixels of grid cells region statistics are computed on, 1 for exact statistics
+        """
+        assert cell_size >= 1
+        self.size = pil_img.size
+        self.cell_size = cell_size
+        self._pil_img = pil_img
+        self._mean = None
+        self._hist = None
+        self._channel_integral = None
+        self._lum_integral = None
+        self._lum_sq_integral = None
+
+    @property
+    def mean(self) -> np.ndarray:
+        """
+        Per channel mean of whole image, shape (channels,)
+        """
+        if self._mean is None:
+            self._mean = self._color_pixels().mean(axis=(0, 1))
+        return self._mean
+
+    @property
+    def hist(self) -> np.ndarray:
+        """
+        Per channel histogram, shape (channels, 256)
+        """
+        if self._hist is None:
+            np_img = self._color_pixels()
+            self._hist = np.stack(
+                [np.bincount(np_img[:, :, c].ravel(), minlength=256) for c in range(np_img.shape[2])]
+            )
+        return self._hist
+
+    def clip_box(self, box: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        width, height = self.size
+        left, top = min(max(box[0], 0), width), min(max(box[1], 0), height)
+        right, bottom = min(max(box[2], left), width), min(max(box[3], top), height)
+        return left, top, right, bottom
+
+    def region_mean(self, box: Tuple[int, int, int, int] = None) -> np.ndarray:
+        """
+        Per channel mean of region in O(1)
+
+        Args:
+            box: (left, top, right, bottom), clipped to image. None for whole image
+
+        Returns:
+            np.ndarray of shape (channels,)
+        """
+        width, height = self.size
+        if box is None or tuple(box) == (0, 0, width, height):
+            return self.mean
+        box = self.clip_box(box)
+        if box[0] == box[2] or box[1] == box[3]:
+            return self.mean
+        cell_box = self._cell_box(box)
+        return _region_sum(self._get_channel_integral(), cell_box) / self._cell_area(cell_box)
+
+    def region_lum(self, box: Tuple[int, int, int, int]) -> Tuple[float, float]:
+        """
+        Luminance mean and standard deviation of region in O(1)
+
+        Args:
+            box: (left, top, right, bottom), clipped to image
+
+        Returns:
+            mean, std
+        """
+        box = self.clip_box(box)
+        if box[0] == box[2] or box[1] == box[3]:
+            box = (0, 0) + tuple(self.size)
+        lum_integral, lum_sq_integral = self._get_lum_integrals()
+        cell_box = self._cell_box(box)
+        area = self._cell_area(cell_box)
+        mean = float(_region_sum(lum_integral, cell_box)) / area
+        var = float(_region_sum(lum_sq_integral, cell_box)) / area - mean * mean
+        return mean, float(np.sqrt(max(var, 0.0)))
+
+    def _color_pixels(self) -> np.ndarray:
+        # (h, w, channels) without alpha channel, background images are not transparent
+        np_img = np.asarray(self._pil_img)
+        if np_img.ndim == 2:
+            return np_img[:, :, None]
+        return np_img[:, :, :3]
+
+    def _cell_box(self, box: Tuple[int, int, int, int]) -> Tuple[int, int, int, int]:
+        # snap non-empty pixel box to the nearest borders of grid cells, at least one cell
+        width, height = self.size
+        left, right = self._snap(box[0], width), self._snap(box[2], width)
+        top, bottom = self._snap(box[1], height), self._snap(box[3], height)
+        cols, rows = self._snap(width, width), self._snap(height, height)
+        left, top = min(left, cols - 1), min(top, rows - 1)
+        return left, top, max(right, left + 1), max(bottom, top + 1)
+
+    def _cell_area(self, cell_box: Tuple[int, int, int, int]) -> int:
+        # pixels of cells, cells of the last row/column may be partial
+        width, height = self.size
+        left, top, right, bottom = (v * self.cell_size for v in cell_box)
+        return (min(right, width) - left) * (min(bottom, height) - top)
+
+    def _snap(self, v: int, size: int) -> int:
+        # index of cell border nearest to pixel v, the last border is at size
+        num_cells = -(-size // self.cell_size)
+        last_start = (num_cells - 1) * self.cell_size
+        if v > last_start:
+            return num_cells if size - v <= v - last_start else num_cells - 1
+        return int(v / self.cell_size + 0.5)
+
+    def _cell_integral(self, np_img: np.ndarray, dtype=np.uint32) -> np.ndarray:
+        """
+        (h, w, ...) pixels -> (rows + 1, cols + 1, ...) float64 integral image of cell sums,
+        dtype of first pass must hold sum of cell_size pixels
+        """
+        height, width = np_img.shape[:2]
+        row_starts = np.arange(0, height, self.cell_size)
+        col_starts = np.arange(0, width, self.cell_size)
+        sums = np.add.reduceat(np_img, row_starts, axis=0, dtype=dtype)
+        sums = np.add.reduceat(sums, col_starts, axis=1, dtype=np.float64)
+        return _integral_image(sums, np.float64)
+
+    def _get_channel_integral(self) -> np.ndarray:
+        if self._channel_integral is None:
+            if self._pil_img.mode == "L":
+                self._channel_integral = self._get_lum_integrals()[0][:, :, None]
+            else:
+                self._channel_integral = self._cell_integral(self._color_pixels())
+        return self._channel_integral
+
+    def _get_lum_integrals(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._lum_integral is None:
+            lum = np.asarray(self._pil_img.convert("L"))
+            self._lum_integral = self._cell_integral(lum)
+            self._lum_sq_integral = self._cell_integral(lum.astype(np.uint32) ** 2)
+        return self._lum_integral, self._lum_sq_integral
+
+
+class Background(NamedTuple):
+    # readonly Pillow image sharing pixels with array
+    img: PILImage
+    # (h, w) for L image, (h, w, 4) for RGBA image
+    array: np.ndarray
+    stats: BgStats
+
+
 class BgManager:
-    def __init__(self, bg_dir: Path, pre_load: bool = True):
+    def __init__(self, bg_dir: Path, pre_load: bool = True, gray: bool = False):
+        """
+
+        Parameters
+        ----------
+        bg_dir : Path
+        pre_load : bool
+            Load all background images at start
+        gray : bool
+            Store background images as L image instead of RGBA
+        """
         self.bg_paths: List[str] = []
-        self.bg_imgs: List[PILImage] = []
+        self.bgs: List[Background] = []
         self.pre_load = pre_load
+        self.gray = gray
 
         for p in bg_dir.glob("**/*"):
             if p.suffix in IMAGE_EXTENSIONS:
@@ -25,9 +220,9 @@ class BgManager:
                     continue
                 self.bg_paths.append(str(p))
                 if pre_load:
-                    self.bg_imgs.append(self._get_bg(str(p)))
+                    self.bgs.append(self._load_bg(str(p)))
 
-        assert len(self.bg_imgs) != 0, "background image is empty"
+        assert len(self.bg_paths) != 0, "background image is empty"
 
     def _is_transparent_image(self, p: Path):
         pil_img: PILImage = Image.open(p)
@@ -36,14 +231,15 @@ class BgManager:
         return not np.all(np_img[:, :, 3] == 255)
 
     def get_bg(self) -> PILImage:
+        return self.sample().img
+
+    def sample(self) -> Background:
         # TODO: add efficient data augmentation
         if self.pre_load:
-            return random_choice(self.bg_imgs)
+            return random_choice(self.bgs)
 
         bg_path = random_choice(self.bg_paths)
-        pil_img = self._get_bg(bg_path)
-
-        return pil_img
+        return self._get_bg(bg_path)
 
     def guard_bg_size(self, pil_img: PILImage, size: Tuple[int, int]) -> PILImage:
         """
@@ -54,17 +250,24 @@ class BgManager:
         scale = max(width / pil_img.size[0], height / pil_img.size[1])
         if scale > 1:
             img_width, img_height = pil_img.size
-            scaled_width = int(img_width * scale)
-            scaled_height = int(img_height * scale)
+            # int() may lose 1px, e.g. 50 * (57 / 50) = 56.99...
+            scaled_width = math.ceil(img_width * scale)
+            scaled_height = math.ceil(img_height * scale)
             pil_img = pil_img.resize((scaled_width, scaled_height))
         return pil_img
 
     @lru_cache(maxsize=32)
-    def _get_bg(self, bg_path: str) -> PILImage:
+    def _get_bg(self, bg_path: str) -> Background:
+        # 实现一种 cache 机制，可以在一定次数内使用相同的图片
+        return self._load_bg(bg_path)
+
+    def _load_bg(self, bg_path: str) -> Background:
         """
-        return RGBA Pillow image
+        RGBA background, L if gray
         """
-        # 实现一种 cache 机制，可以在一定次数内使用相同的图片
         pil_img: PILImage = Image.open(bg_path)
-        pil_img = pil_img.convert("RGBA")
-        return pil_img
+        pil_img = pil_img.convert("L" if self.gray else "RGBA")
+        array = np.asarray(pil_img)
+        # BgStats keeps the image sharing pixels with array, statistics are built on first use
+        img = Image.fromarray(array)
+        return Background(img, array, BgStats(img))
@@ -1,10 +1,11 @@
 import importlib
 import os
+import random
 import typing
 from abc import abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
 import numpy as np
 from PIL.Image import Image as PILImage
@@ -12,8 +13,10 @@ from PIL.Image import Image as PILImage
 from text_renderer.effect import Effects
 from text_renderer.layout import Layout
 from text_renderer.layout.same_line import SameLineLayout
+from text_renderer.utils.utils import relative_xy_offset
 
 if typing.TYPE_CHECKING:
+    from text_renderer.bg_manager import BgStats
     from text_renderer.corpus import Corpus
 
 
@@ -21,6 +24,19 @@ if typing.TYPE_CHECKING:
 class PerspectiveTransformCfg:
     """
     Base class for PerspectiveTransform
+
+    Parameters
+    ----------
+    bank_size : int
+        If > 0, Render precomputes warp matrices of bank_size angles sampled by get_xyz()
+        for each aspect ratio bucket, and samples from them instead of building a matrix
+        for every image. Set 0 to disable
+    bank_angle_step : float
+        Round angles of the bank to multiple of this value in degrees, 0 keeps sampled angles
+    bank_aspect_step : float
+        Width/height ratio step of aspect ratio buckets of the bank
+    bank_max_aspect : float
+        Images with larger width/height ratio use the largest bucket
     """
 
     x: float = 10
@@ -28,6 +44,10 @@ class PerspectiveTransformCfg:
     z: float = 1.5
     scale: int = 1
     fovy: int = 50
+    bank_size: int = 0
+    bank_angle_step: float = 0
+    bank_aspect_step: float = 0.5
+    bank_max_aspect: float = 32
 
     @abstractmethod
     def get_xyz(self) -> Tuple[int, int, int]:
@@ -85,14 +105,41 @@ class TextColorCfg:
     """
 
     @abstractmethod
-    def get_color(self, bg_img: PILImage) -> Tuple[int, int, int, int]:
+    def get_color(
+        self,
+        bg_img: PILImage,
+        *,
+        bg_stats: "BgStats" = None,
+        region: Tuple[int, int, int, int] = None,
+    ) -> Tuple[int, int, int, int]:
+        """
+
+        Parameters
+        ----------
+        bg_img : PILImage
+            Background image, or the image to draw on (e.g. text mask in effects)
+        bg_stats : BgStats
+            Precomputed statistics of bg_img, None if not available
+        region : Tuple[int, int, int, int]
+            (left, top, right, bottom) region of bg_img text will be pasted on,
+            None for whole image
+
+        bg_stats and region are keyword only, subclasses overriding get_color(self, bg_img)
+        still work: Render only passes them if get_color accepts them.
+        """
         pass
 
 
 @dataclass
 class FixedTextColorCfg(TextColorCfg):
     # For generate effect/layout example
-    def get_color(self, bg_img: PILImage) -> Tuple[int, int, int, int]:
+    def get_color(
+        self,
+        bg_img: PILImage,
+        *,
+        bg_stats: "BgStats" = None,
+        region: Tuple[int, int, int, int] = None,
+    ) -> Tuple[int, int, int, int]:
         alpha = 255
         text_color = (255, 50, 0, alpha)
 
@@ -102,14 +149,23 @@ class FixedTextColorCfg(TextColorCfg):
 @dataclass
 class SimpleTextColorCfg(TextColorCfg):
     """
-    Randomly use mean value of background image
+    Randomly use mean value of background image (the region text is pasted on if bg_stats is given)
     """
 
     alpha: Tuple[int, int] = (110, 255)
 
-    def get_color(self, bg_img: PILImage) -> Tuple[int, int, int, int]:
-        np_img = np.array(bg_img)
-        mean = np.mean(np_img)
+    def get_color(
+        self,
+        bg_img: PILImage,
+        *,
+        bg_stats: "BgStats" = None,
+        region: Tuple[int, int, int, int] = None,
+    ) -> Tuple[int, int, int, int]:
+        if bg_stats is not None:
+            mean = np.mean(bg_stats.region_mean(region))
+        else:
+            np_img = np.array(bg_img)
+            mean = np.mean(np_img)
 
         alpha = np.random.randint(*self.alpha)
         r = np.random.randint(0, int(mean * 0.7))
@@ -120,6 +176,77 @@ class SimpleTextColorCfg(TextColorCfg):
         return text_color
 
 
+class PlacementCfg:
+    """
+    Base class for PlacementCfg, choose relative position of text on background
+    """
+
+    @abstractmethod
+    def get_placement(
+        self, bg_stats: "BgStats", text_size: Tuple[int, int]
+    ) -> Tuple[float, float]:
+        """
+
+        Parameters
+        ----------
+        bg_stats : BgStats
+            Precomputed statistics of background image
+        text_size : Tuple[int, int]
+            (width, height) estimated size of text on background
+
+        Returns
+        -------
+            (x, y) in [0, 1), see :func:`~text_renderer.utils.utils.relative_xy_offset`
+        """
+        pass
+
+
+@dataclass
+class RegionStatsPlacementCfg(PlacementCfg):
+    """
+    Evaluate random positions by luminance mean and standard deviation of background
+    region in O(1), use the first one meeting the constraints, or the one closest to them.
+    No rendered image is rejected.
+
+    Parameters
+    ----------
+    min_mean : float
+        Min luminance mean of region, e.g. dark text needs a bright region
+    max_mean : float
+        Max luminance mean of region
+    max_std : float
+        Max luminance standard deviation of region, busy texture makes text unreadable
+    num_candidates : int
+        Max random positions evaluated for each image
+    """
+
+    min_mean: float = 0
+    max_mean: float = 255
+    max_std: float = 255
+    num_candidates: int = 8
+
+    def get_placement(
+        self, bg_stats: "BgStats", text_size: Tuple[int, int]
+    ) -> Tuple[float, float]:
+        best_placement = None
+        best_cost = float("inf")
+        for _ in range(max(self.num_candidates, 1)):
+            placement = (random.random(), random.random())
+            x, y = relative_xy_offset(text_size, bg_stats.size, placement)
+            mean, std = bg_stats.region_lum((x, y, x + text_size[0], y + text_size[1]))
+
+            cost = (
+                max(self.min_mean - mean, 0)
+                + max(mean - self.max_mean, 0)
+                + max(std - self.max_std, 0)
+            )
+            if cost == 0:
+                return placement
+            if cost < best_cost:
+                best_placement, best_cost = placement, cost
+        return best_placement
+
+
 # noinspection PyUnresolvedReferences
 @dataclass
 class RenderCfg:
@@ -127,8 +254,9 @@ class RenderCfg:
 
     Parameters
     ----------
-    corpus : Union[Corpus, List[Corpus]]
-
+    corpus : Corpus
+        Corpus sampled by ``main.py`` to get the text of each image.
+        Not used when :class:`~text_renderer.render.Render` is called with a FontText directly.
     corpus_effects : Union[Effects, List[Effects]]
         Effects apply on text mask image of each corpus.
         Effects used at this stage must return changed bbox of text if it modified it.
@@ -147,14 +275,27 @@ class RenderCfg:
     height : int
         Resize(keep ratio) image to height, set -1 disables resize
     gray : bool
-        Save image as gray image
+        Save image as gray image. Background is loaded as L image and text is rendered as
+        LA image, so effects and perspective transform work on luminance and alpha only.
+        Colors from text_color_cfg and effects are converted to luminance
     text_color_cfg : TextColorCfg
         If not None, will overwrite text_color_cfg in CorpusCfg
         useful to set same text color when use multi corpus
     return_bg_and_mask: bool
+    placement_cfg : PlacementCfg
+        If not None, choose position of text on background by background region statistics,
+        otherwise position is uniformly random
+    fit_font_size : bool
+        Change font size of horizontal text, so text mask height is about height after
+        perspective transform. The whole pipeline then runs at near output resolution and
+        the resize to height is only a small correction. Ignored if height is -1
+    cluster_cache_size : int
+        Max bytes of :class:`~text_renderer.utils.cluster_cache.ClusterCache`, horizontal text is
+        composed from cached clusters (e.g. Khmer syllables) instead of rendering whole line.
+        Set 0 to disable
     """
 
-    # corpus: Union["Corpus", List["Corpus"]]
+    corpus: "Corpus" = None
     corpus_effects: Union[Effects, List[Effects]] = None
     bg_dir: Path = None
     pre_load_bg_img: bool = True
@@ -166,6 +307,9 @@ class RenderCfg:
     gray: bool = True
     text_color_cfg: TextColorCfg = None
     return_bg_and_mask: bool = False
+    placement_cfg: PlacementCfg = None
+    fit_font_size: bool = False
+    cluster_cache_size: int = 0
 
 
 # noinspection PyUnresolvedReferences
@@ -180,11 +324,15 @@ class GeneratorCfg:
         The directory where the data is stored
     render_cfg : RenderCfg
         Configuration of Render
+    dataset_kwargs : dict
+        Extra arguments of the dataset class selected by --dataset,
+        e.g: dict(commit_interval=100, sync=False) for lmdb
     """
 
     num_image: int
     save_dir: Path
     render_cfg: RenderCfg
+    dataset_kwargs: Dict = field(default_factory=dict)
 
 
 def get_cfg(config_file: str) -> List[GeneratorCfg]:
@@ -1,11 +1,54 @@
+import glob
+import io
 import os
 import json
-from typing import Dict
+import tarfile
+import time
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import lmdb
 import cv2
 import numpy as np
 from filelock import FileLock
+from loguru import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def encode_jpg(image: np.ndarray, jpg_quality: int = 95) -> bytes:
+    """
+    Encode image as jpg bytes, empty image is encoded as empty bytes
+    """
+    if image.shape[0] == 0 or image.shape[1] == 0:
+        return b""
+    return cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), jpg_quality])[
+        1
+    ].tobytes()
+
+
+def next_file_index(data_dir: str, prefix: str, ext: str, listed: List[str]) -> int:
+    """
+    Index of the next {prefix}-{index:06d}{ext} file in data_dir. Files on disk are
+    counted, so a file left by a killed run (not in listed) is not overwritten.
+    """
+    index = len(listed)
+    for path in glob.glob(os.path.join(data_dir, f"{prefix}-*{ext}")):
+        filename = os.path.basename(path)
+        number = filename[len(prefix) + 1 : -len(ext)]
+        if not number.isdigit():
+            continue
+        if filename not in listed:
+            logger.warning(f"Skip {path}, it is not in meta.json (left by a killed run?)")
+        index = max(index, int(number) + 1)
+    return index
+
 
 class Dataset:
     def __init__(self, data_dir: str, jpg_quality: int = 95):
@@ -17,7 +60,37 @@ class Dataset:
     def encode_param(self):
         return [int(cv2.IMWRITE_JPEG_QUALITY), self.jpg_quality]
 
-    def write(self, name: str, image: np.ndarray, label: str):
+    def encode(self, image: np.ndarray) -> bytes:
+        return encode_jpg(image, self.jpg_quality)
+
+    def write(self, name: str, image: np.ndarray, label: str, meta: Dict = None):
+        height, width = image.shape[:2]
+        self.write_bytes(name, self.encode(image), label, (width, height), meta)
+
+    def write_bytes(
+        self,
+        name: str,
+        image_bytes: bytes,
+        label: str,
+        size: Tuple[int, int],
+        meta: Dict = None,
+    ):
+        """
+        Write already encoded image, e.g. encoded by :func:`encode_jpg` in render process
+
+        Parameters
+        ----------
+            name : str
+                000000001
+            image_bytes : bytes
+                jpg bytes
+            label : str
+            size : Tuple[int, int]
+                (width, height) of image
+            meta : Dict
+                Extra info of the sample, e.g: font_path, font_size, effects.
+                Ignored by datasets which don't store it
+        """
         pass
 
     def read(self, name) -> Dict:
@@ -60,77 +133,169 @@ class Dataset:
 
 class ImgDataset(Dataset):
     """
-    Save generated image as jpg file, save label and meta in json
-    json file format:
+    Save generated image as jpg file, save label and meta in an append-only label log (labels.jsonl).
+    The first line of label log is a fixed size header, each following line is a sample:
 
     .. code-block:: bash
 
-        {
-             "labels": {
-                "000000000": "test",
-                "000000001": "text2"
-             },
-             "sizes": {
-                "000000000": [width, height],
-                "000000001": [width, height],
-             }
-             "num-samples": 2,
-        }
+        {"num-samples": 2}
+        {"name": "000000000", "label": "test", "size": [width, height]}
+        {"name": "000000001", "label": "text2", "size": [width, height]}
+
+    Writing a sample only appends a line, read_count only reads the header.
+    labels.json written by old version is converted to label log when opened.
+
+    Lines are appended to label log every flush_interval samples or flush_bytes bytes,
+    the header count is updated at the same time, so a crashed run keeps flushed samples.
     """
 
     LABEL_NAME = "labels.json"
+    HEADER_SIZE = 64
 
-    def __init__(self, data_dir: str, label_filename: str = None):
+    def __init__(
+        self,
+        data_dir: str,
+        label_filename: str = None,
+        flush_interval: int = 1000,
+        flush_bytes: int = 1024 * 1024,
+    ):
+        """
+
+        Parameters
+        ----------
+            data_dir : str
+            label_filename : str
+                Default is labels.json, label log is saved with .jsonl extension, e.g: labels.jsonl
+            flush_interval : int
+                Flush after writing flush_interval samples, set -1 to disable
+            flush_bytes : int
+                Flush after pending lines reach flush_bytes bytes, set -1 to disable
+        """
         super().__init__(data_dir)
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
         self._img_dir = os.path.join(data_dir, "images")
         if not os.path.exists(self._img_dir):
             os.makedirs(self._img_dir)
-        
-        if label_filename is None:    
-            self._label_path = os.path.join(data_dir, self.LABEL_NAME)
-        else:
-            self._label_path = os.path.join(data_dir, label_filename)
 
-        self._data = {"num-samples": 0, "labels": {}, "sizes": {}}
-        if os.path.exists(self._label_path):
-            with FileLock(self._label_path + '.lock'):
-                with open(self._label_path, "r", encoding="utf-8") as f:
-                    self._data = json.load(f)
+        if label_filename is None:
+            label_filename = self.LABEL_NAME
+        legacy_label_path = os.path.join(data_dir, label_filename)
+        self._label_path = os.path.splitext(legacy_label_path)[0] + ".jsonl"
+        self._lock = FileLock(self._label_path + ".lock")
+
+        # lines not flushed to label log
+        self._pending: List[str] = []
+        self._pending_bytes = 0
+        # name -> (label, size), built on first read
+        self._index: Optional[Dict[str, Tuple[str, List[int]]]] = None
 
-    def write(self, name: str, image: np.ndarray, label: str):
-        
+        with self._lock:
+            if not os.path.exists(self._label_path):
+                self._init_label_log(legacy_label_path)
+            self._count = self._read_header()
+        self._header_count = self._count
+
+    def write_bytes(
+        self,
+        name: str,
+        image_bytes: bytes,
+        label: str,
+        size: Tuple[int, int],
+        meta: Dict = None,
+    ):
         img_path = os.path.join(self._img_dir, name + ".jpg")
-        shape = image.shape
-        if shape[0]==0 or shape[1]==0:
-            open(img_path, 'a').close()
-        else:
-            cv2.imwrite(img_path, image, self.encode_param())
-            
-        self._data["labels"][name] = label
+        with open(img_path, "wb") as f:
+            f.write(image_bytes)
 
-        height, width = image.shape[:2]
-        self._data["sizes"][name] = (width, height)
+        size = list(size)
+        line = self._record_line(name, label, size)
+        self._pending.append(line)
+        self._pending_bytes += len(line)
+        self._count += 1
+        if self._index is not None:
+            self._index[name] = (label, size)
+
+        if (
+            self.flush_interval != -1 and len(self._pending) >= self.flush_interval
+        ) or (self.flush_bytes != -1 and self._pending_bytes >= self.flush_bytes):
+            self.flush()
 
     def read(self, name: str) -> Dict:
         img_path = os.path.join(self._img_dir, name + ".jpg")
         image = cv2.imread(img_path)
-        label = self._data["labels"][name]
-        size = self._data["sizes"][name]
+        label, size = self._get_index()[name]
         return {"image": image, "label": label, "size": size}
 
     def read_size(self, name: str) -> [int, int]:
-        return self._data["sizes"][name]
+        return self._get_index()[name][1]
 
     def read_count(self) -> int:
-        return self._data.get("num-samples", 0)
+        return self._count
 
     def write_count(self, count: int):
-        self._data["num-samples"] = count
+        self._count = count
+
+    def flush(self):
+        """
+        Append pending samples to label log and update header
+        """
+        if len(self._pending) == 0 and self._count == self._header_count:
+            return
+
+        with self._lock:
+            with open(self._label_path, "a", encoding="utf-8") as f:
+                f.write("".join(self._pending))
+            self._pending = []
+            self._pending_bytes = 0
+
+            if self._count != self._header_count:
+                with open(self._label_path, "r+b") as f:
+                    f.write(self._header_line(self._count).encode())
+                self._header_count = self._count
 
     def close(self):
-        with FileLock(self._label_path + '.lock'):
-            with open(self._label_path, "w", encoding="utf-8") as f:
-                json.dump(self._data, f, indent=2, ensure_ascii=False)
+        self.flush()
+
+    def _init_label_log(self, legacy_label_path: str):
+        count = 0
+        lines = []
+        if os.path.exists(legacy_label_path):
+            with open(legacy_label_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            count = data.get("num-samples", 0)
+            lines = [
+                self._record_line(name, label, data["sizes"][name])
+                for name, label in data["labels"].items()
+            ]
+
+        with open(self._label_path, "w", encoding="utf-8") as f:
+            f.write(self._header_line(count))
+            f.writelines(lines)
+
+    def _read_header(self) -> int:
+        with open(self._label_path, "rb") as f:
+            header = f.readline(self.HEADER_SIZE)
+        return json.loads(header)["num-samples"]
+
+    def _header_line(self, count: int) -> str:
+        return json.dumps({"num-samples": count}).ljust(self.HEADER_SIZE - 1) + "\n"
+
+    @staticmethod
+    def _record_line(name: str, label: str, size) -> str:
+        record = {"name": name, "label": label, "size": list(size)}
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def _get_index(self) -> Dict[str, Tuple[str, List[int]]]:
+        if self._index is None:
+            self.flush()
+            self._index = {}
+            with open(self._label_path, "r", encoding="utf-8") as f:
+                f.readline()
+                for line in f:
+                    record = json.loads(line)
+                    self._index[record["name"]] = (record["label"], record["size"])
+        return self._index
 
 
 class LmdbDataset(Dataset):
@@ -142,22 +307,88 @@ class LmdbDataset(Dataset):
         - label-000000001: string
         - size-000000001: "width,height"
 
+    Written data is committed every commit_interval images or commit_bytes bytes,
+    "num-samples" is updated at each commit, so a crashed run keeps committed images.
+
+    Parameters
+    ----------
+        data_dir : str
+        map_size : int
+            Maximum size of lmdb file, default is 1T
+        writemap : bool
+            Use a writeable memory map, see lmdb.open
+        map_async : bool
+            When writemap=True, flush asynchronously, see lmdb.open
+        sync : bool
+            Flush to disk on each commit. If False, only flush when close
+        commit_interval : int
+            Commit after writing commit_interval images, set -1 to disable
+        commit_bytes : int
+            Commit after writing commit_bytes bytes, set -1 to disable
     """
 
-    def __init__(self, data_dir: str):
+    def __init__(
+        self,
+        data_dir: str,
+        map_size: int = 1099511627776,
+        writemap: bool = False,
+        map_async: bool = False,
+        sync: bool = True,
+        commit_interval: int = 1000,
+        commit_bytes: int = 64 * 1024 * 1024,
+    ):
         super().__init__(data_dir)
-        self._lmdb_env = lmdb.open(self.data_dir, map_size=1099511627776)  # 1T
+        self.sync = sync
+        self.commit_interval = commit_interval
+        self.commit_bytes = commit_bytes
+        self._lmdb_env = lmdb.open(
+            self.data_dir,
+            map_size=map_size,
+            writemap=writemap,
+            map_async=map_async,
+            sync=sync,
+        )
         self._lmdb_txn = self._lmdb_env.begin(write=True)
+        self._count = self.read_count()
+        self._uncommitted_count = 0
+        self._uncommitted_bytes = 0
 
-    def write(self, name: str, image: np.ndarray, label: str):
-        self._lmdb_txn.put(
-            self.image_key(name),
-            cv2.imencode(".jpg", image, self.encode_param())[1].tobytes(),
-        )
-        self._lmdb_txn.put(self.label_key(name), label.encode())
+    def write_bytes(
+        self,
+        name: str,
+        image_bytes: bytes,
+        label: str,
+        size: Tuple[int, int],
+        meta: Dict = None,
+    ):
+        label_bytes = label.encode()
+        width, height = size
+        size_bytes = f"{width},{height}".encode()
 
-        height, width = image.shape[:2]
-        self._lmdb_txn.put(self.size_key(name), f"{width},{height}".encode())
+        self._lmdb_txn.put(self.image_key(name), image_bytes)
+        self._lmdb_txn.put(self.label_key(name), label_bytes)
+        self._lmdb_txn.put(self.size_key(name), size_bytes)
+
+        self._count += 1
+        self._uncommitted_count += 1
+        self._uncommitted_bytes += len(image_bytes) + len(label_bytes) + len(size_bytes)
+        if (
+            self.commit_interval != -1
+            and self._uncommitted_count >= self.commit_interval
+        ) or (
+            self.commit_bytes != -1 and self._uncommitted_bytes >= self.commit_bytes
+        ):
+            self.commit()
+
+    def commit(self):
+        """
+        Commit written data with "num-samples", and start a new write transaction
+        """
+        self.write_count(self._count)
+        self._lmdb_txn.commit()
+        self._lmdb_txn = self._lmdb_env.begin(write=True)
+        self._uncommitted_count = 0
+        self._uncommitted_bytes = 0
 
     def read(self, name: str) -> Dict:
         label = self._lmdb_txn.get(self.label_key(name)).decode()
@@ -179,13 +410,10 @@ class LmdbDataset(Dataset):
         Returns: (width, height)
 
         """
-        size_key = f"size_{name}"
+        size = self._lmdb_txn.get(self.size_key(name)).decode()
+        width, height = size.split(",")
 
-        size = self._lmdb_txn.get(size_key.encode()).decode()
-        width = int(size.split[","][0])
-        height = int(size.split[","][1])
-
-        return width, height
+        return int(width), int(height)
 
     def read_count(self) -> int:
         count = self._lmdb_txn.get("num-samples".encode())
@@ -194,6 +422,7 @@ class LmdbDataset(Dataset):
         return int(count)
 
     def write_count(self, count: int):
+        self._count = count
         self._lmdb_txn.put("num-samples".encode(), str(count).encode())
 
     def image_key(self, name: str):
@@ -209,10 +438,591 @@ class LmdbDataset(Dataset):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self._lmdb_txn.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            # "num-samples" of last commit may be out of date
+            self.commit()
+        self._lmdb_txn.abort()
+        if not self.sync:
+            self._lmdb_env.sync(True)
         self._lmdb_env.close()
 
 
+class PackedDataset(Dataset):
+    """
+    Save generated images as raw uint8 pixels without encoding, so training loader
+    doesn't need to decode images. Best for gray images with fixed height.
+    Files in data_dir:
+
+        - images.bin: pixels of all images (C order) concatenated
+        - labels.bin: utf-8 bytes of all labels concatenated
+        - index.bin: one :data:`PACKED_INDEX_DTYPE` record per image
+        - meta.json: {"num-samples": 2}, written on flush
+
+    Images must be written with sequential names: 000000000, 000000001...
+    Count of samples is the number of records in index.bin, so writing can be resumed
+    after a crash even if meta.json was not written.
+    Use :class:`PackedReader` to read images as zero-copy np.memmap slices.
+    """
+
+    IMAGES_NAME = "images.bin"
+    LABELS_NAME = "labels.bin"
+    INDEX_NAME = "index.bin"
+    META_NAME = "meta.json"
+
+    def __init__(self, data_dir: str):
+        super().__init__(data_dir)
+        self._meta_path = os.path.join(data_dir, self.META_NAME)
+
+        index_path = os.path.join(data_dir, self.INDEX_NAME)
+        images_path = os.path.join(data_dir, self.IMAGES_NAME)
+        labels_path = os.path.join(data_dir, self.LABELS_NAME)
+
+        # index record is written last, drop data of incomplete record if last run crashed
+        index = PackedReader.load_index(index_path)
+        self._num_records = len(index)
+        images_end, labels_end = 0, 0
+        if self._num_records != 0:
+            last = index[-1]
+            images_end = int(last["offset"]) + packed_image_nbytes(last)
+            labels_end = int(last["label_offset"]) + int(last["label_size"])
+        del index
+
+        self._index_file = self._open_append(
+            index_path, self._num_records * PACKED_INDEX_DTYPE.itemsize
+        )
+        self._images_file = self._open_append(images_path, images_end)
+        self._labels_file = self._open_append(labels_path, labels_end)
+        self._reader: Optional[PackedReader] = None
+
+    def write(self, name: str, image: np.ndarray, label: str, meta: Dict = None):
+        if int(name) != self._num_records:
+            raise ValueError(
+                f"{self.__class__.__name__} only support sequential name, "
+                f"expect {self._num_records:09d} but got {name}"
+            )
+
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        label_bytes = label.encode()
+        record = np.zeros(1, dtype=PACKED_INDEX_DTYPE)
+        record["offset"] = self._images_file.tell()
+        record["label_offset"] = self._labels_file.tell()
+        record["label_size"] = len(label_bytes)
+        record["height"], record["width"] = image.shape[:2]
+        record["channels"] = image.shape[2] if image.ndim == 3 else 0
+
+        self._images_file.write(image.tobytes())
+        self._labels_file.write(label_bytes)
+        self._index_file.write(record.tobytes())
+        self._num_records += 1
+        self._reader = None
+
+    def write_bytes(
+        self,
+        name: str,
+        image_bytes: bytes,
+        label: str,
+        size: Tuple[int, int],
+        meta: Dict = None,
+    ):
+        # Images encoded in render process have to be decoded back to pixels
+        if len(image_bytes) == 0:
+            image = np.zeros((size[1], size[0]), dtype=np.uint8)
+        else:
+            image_buf = np.frombuffer(image_bytes, dtype=np.uint8)
+            image = cv2.imdecode(image_buf, cv2.IMREAD_UNCHANGED)
+        self.write(name, image, label, meta)
+
+    def read(self, name: str) -> Dict:
+        image, label = self._get_reader()[int(name)]
+        height, width = image.shape[:2]
+        return {"image": image, "label": label, "size": [width, height]}
+
+    def read_size(self, name: str) -> [int, int]:
+        return self.read(name)["size"]
+
+    def read_count(self) -> int:
+        return self._num_records
+
+    def write_count(self, count: int):
+        # count is always the number of records in index
+        pass
+
+    def flush(self):
+        for f in [self._images_file, self._labels_file, self._index_file]:
+            f.flush()
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({"num-samples": self._num_records}, f)
+
+    def close(self):
+        self.flush()
+        self._reader = None
+        for f in [self._images_file, self._labels_file, self._index_file]:
+            f.close()
+
+    @staticmethod
+    def _open_append(path: str, size: int):
+        f = open(path, "ab")
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    def _get_reader(self) -> "PackedReader":
+        if self._reader is None:
+            self.flush()
+            self._reader = PackedReader(self.data_dir)
+        return self._reader
+
+
+# index record of an image in PackedDataset, channels is 0 for 2D image
+PACKED_INDEX_DTYPE = np.dtype(
+    [
+        ("offset", "<i8"),
+        ("label_offset", "<i8"),
+        ("label_size", "<i4"),
+        ("height", "<i4"),
+        ("width", "<i4"),
+        ("channels", "<i4"),
+    ]
+)
+
+
+def packed_image_nbytes(record) -> int:
+    return int(record["height"]) * int(record["width"]) * max(int(record["channels"]), 1)
+
+
+class PackedReader:
+    """
+    Read :class:`PackedDataset` with O(1) random access, images are zero-copy np.memmap slices.
+    Cheap to open, e.g. in each worker of a training data loader.
+
+    .. code-block:: python
+
+        reader = PackedReader("output/packed")
+        image, label = reader[0]
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self._index = self.load_index(os.path.join(data_dir, PackedDataset.INDEX_NAME))
+        self._images = self._memmap(os.path.join(data_dir, PackedDataset.IMAGES_NAME))
+        self._labels = self._memmap(os.path.join(data_dir, PackedDataset.LABELS_NAME))
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, str]:
+        record = self._index[i]
+        offset = int(record["offset"])
+        height, width, channels = (int(record[k]) for k in ["height", "width", "channels"])
+        shape = (height, width, channels) if channels != 0 else (height, width)
+        image = self._images[offset : offset + packed_image_nbytes(record)].reshape(shape)
+
+        label_offset = int(record["label_offset"])
+        label = self._labels[label_offset : label_offset + int(record["label_size"])]
+        return image, label.tobytes().decode()
+
+    def widths(self) -> np.ndarray:
+        return np.asarray(self._index["width"])
+
+    @staticmethod
+    def load_index(index_path: str) -> np.ndarray:
+        if not os.path.exists(index_path):
+            return np.zeros(0, dtype=PACKED_INDEX_DTYPE)
+        num_records = os.path.getsize(index_path) // PACKED_INDEX_DTYPE.itemsize
+        if num_records == 0:
+            return np.zeros(0, dtype=PACKED_INDEX_DTYPE)
+        return np.memmap(index_path, dtype=PACKED_INDEX_DTYPE, mode="r", shape=(num_records,))
+
+    @staticmethod
+    def _memmap(path: str) -> np.ndarray:
+        # np.memmap can't map empty file
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+class TarShardDataset(Dataset):
+    """
+    Save generated images into tar shards (WebDataset style), each sample is a pair of files:
+
+        - 000000001.jpg: image bytes
+        - 000000001.txt: utf-8 label
+
+    A new shard (shard-000000.tar, shard-000001.tar...) is started every samples_per_shard samples
+    or bytes_per_shard bytes, and each run starts a new shard. Shard list and count are saved in meta.json
+    when a shard is closed, so a killed run keeps its closed shards:
+
+    .. code-block:: bash
+
+        {
+            "shards": ["shard-000000.tar", "shard-000001.tar"],
+            "num-samples": 2
+        }
+
+    Size is not stored, read() returns size of decoded image.
+    """
+
+    META_NAME = "meta.json"
+
+    def __init__(
+        self,
+        data_dir: str,
+        samples_per_shard: int = 10000,
+        bytes_per_shard: int = 1024 * 1024 * 1024,
+    ):
+        super().__init__(data_dir)
+        self.samples_per_shard = samples_per_shard
+        self.bytes_per_shard = bytes_per_shard
+        self._meta_path = os.path.join(data_dir, self.META_NAME)
+        self._meta = {"shards": [], "num-samples": 0}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                self._meta = json.load(f)
+
+        self._count = self._meta["num-samples"]
+        self._tar: Optional[tarfile.TarFile] = None
+        self._shard: Optional[str] = None
+        self._shard_samples = 0
+        self._shard_bytes = 0
+        # name -> tar path, built on first read
+        self._index: Optional[Dict[str, str]] = None
+
+    def write_bytes(
+        self,
+        name: str,
+        image_bytes: bytes,
+        label: str,
+        size: Tuple[int, int],
+        meta: Dict = None,
+    ):
+        if (
+            self._tar is None
+            or self._shard_samples >= self.samples_per_shard
+            or self._shard_bytes >= self.bytes_per_shard
+        ):
+            self._next_shard()
+
+        label_bytes = label.encode()
+        mtime = time.time()
+        for filename, data in [(name + ".jpg", image_bytes), (name + ".txt", label_bytes)]:
+            info = tarfile.TarInfo(filename)
+            info.size = len(data)
+            info.mtime = mtime
+            self._tar.addfile(info, io.BytesIO(data))
+
+        self._count += 1
+        self._shard_samples += 1
+        self._shard_bytes += len(image_bytes) + len(label_bytes)
+        if self._index is not None:
+            self._index[name] = self._shard
+
+    def read(self, name: str) -> Dict:
+        self._close_shard()
+        if self._index is None:
+            self._index = {}
+            for shard, sample_name, _, _ in self._iter_shard_samples(names_only=True):
+                self._index[sample_name] = shard
+
+        with tarfile.open(os.path.join(self.data_dir, self._index[name]), "r") as tar:
+            image_bytes = tar.extractfile(name + ".jpg").read()
+            label = tar.extractfile(name + ".txt").read().decode()
+
+        image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        height, width = image.shape[:2]
+        return {"image": image, "label": label, "size": [width, height]}
+
+    def iter_samples(self) -> Iterator[Tuple[str, bytes, str]]:
+        """
+        Read all shards sequentially
+
+        Yields:
+            (name, image_bytes, label)
+        """
+        self._close_shard()
+        for _, name, image_bytes, label in self._iter_shard_samples():
+            yield name, image_bytes, label
+
+    def read_count(self) -> int:
+        return self._count
+
+    def write_count(self, count: int):
+        self._count = count
+
+    def close(self):
+        self._close_shard()
+        self._save_meta()
+
+    def _next_shard(self):
+        self._close_shard()
+        index = next_file_index(self.data_dir, "shard", ".tar", self._meta["shards"])
+        self._shard = "shard-{:06d}.tar".format(index)
+        self._tar = tarfile.open(os.path.join(self.data_dir, self._shard), "w")
+        self._shard_samples = 0
+        self._shard_bytes = 0
+
+    def _close_shard(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+            self._meta["shards"].append(self._shard)
+            self._save_meta()
+
+    def _save_meta(self):
+        self._meta["num-samples"] = self._count
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f, indent=2)
+
+    def _iter_shard_samples(self, names_only: bool = False):
+        for shard in self._meta["shards"]:
+            with tarfile.open(os.path.join(self.data_dir, shard), "r") as tar:
+                image_bytes = None
+                for info in tar:
+                    name, ext = os.path.splitext(info.name)
+                    if ext == ".jpg":
+                        if not names_only:
+                            image_bytes = tar.extractfile(info).read()
+                    elif ext == ".txt":
+                        label = None if names_only else tar.extractfile(info).read().decode()
+                        yield shard, name, image_bytes, label
+
+
+class ParquetDataset(Dataset):
+    """
+    Save generated images and meta of each sample in parquet files (requires pyarrow),
+    so dataset can be filtered by column without decoding images. Columns:
+
+        - name: 000000001
+        - image: jpg bytes
+        - label
+        - width, height
+        - font_path, font_size
+        - effects: class names of applied effects
+
+    Images are buffered and written as a row group every row_group_size images.
+    Each run writes a new file (part-000000.parquet, part-000001.parquet...),
+    file list and count are saved in meta.json when the file is closed. A file left
+    by a killed run has no footer, it is not listed in meta.json and never overwritten:
+
+    .. code-block:: bash
+
+        {
+            "parts": ["part-000000.parquet"],
+            "num-samples": 2
+        }
+    """
+
+    META_NAME = "meta.json"
+
+    def __init__(self, data_dir: str, row_group_size: int = 10000):
+        if pa is None:
+            raise ImportError("ParquetDataset requires pyarrow: pip install pyarrow")
+
+        super().__init__(data_dir)
+        self.row_group_size = row_group_size
+        self._schema = pa.schema(
+            [
+                ("name", pa.string()),
+                ("image", pa.binary()),
+                ("label", pa.string()),
+                ("width", pa.int32()),
+                ("height", pa.int32()),
+                ("font_path", pa.string()),
+                ("font_size", pa.int32()),
+                ("effects", pa.list_(pa.string())),
+            ]
+        )
+        self._meta_path = os.path.join(data_dir, self.META_NAME)
+        self._meta = {"parts": [], "num-samples": 0}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as f:
+                self._meta = json.load(f)
+
+        self._count = self._meta["num-samples"]
+        self._writer = None
+        self._part: Optional[str] = None
+        self._columns: Dict[str, List] = {k: [] for k in self._schema.names}
+
+    def write_bytes(
+        self,
+        name: str,
+        image_bytes: bytes,
+        label: str,
+        size: Tuple[int, int],
+        meta: Dict = None,
+    ):
+        meta = meta or {}
+        row = {
+            "name": name,
+            "image": image_bytes,
+            "label": label,
+            "width": size[0],
+            "height": size[1],
+            "font_path": meta.get("font_path"),
+            "font_size": meta.get("font_size"),
+            "effects": meta.get("effects"),
+        }
+        for k, v in row.items():
+            self._columns[k].append(v)
+        self._count += 1
+
+        if len(self._columns["name"]) >= self.row_group_size:
+            self._write_row_group()
+
+    def read(self, name: str) -> Dict:
+        self._close_part()
+        for part in self._meta["parts"]:
+            table = pq.read_table(
+                os.path.join(self.data_dir, part), filters=[("name", "==", name)]
+            )
+            if table.num_rows != 0:
+                row = table.slice(0, 1).to_pylist()[0]
+                image_buf = np.frombuffer(row["image"], dtype=np.uint8)
+                image = cv2.imdecode(image_buf, cv2.IMREAD_UNCHANGED)
+                return {
+                    "image": image,
+                    "label": row["label"],
+                    "size": [row["width"], row["height"]],
+                }
+        raise KeyError(name)
+
+    def read_count(self) -> int:
+        return self._count
+
+    def write_count(self, count: int):
+        self._count = count
+
+    def close(self):
+        self._close_part()
+        self._save_meta()
+
+    def _write_row_group(self):
+        if len(self._columns["name"]) == 0:
+            return
+
+        if self._writer is None:
+            index = next_file_index(self.data_dir, "part", ".parquet", self._meta["parts"])
+            self._part = "part-{:06d}.parquet".format(index)
+            self._writer = pq.ParquetWriter(
+                os.path.join(self.data_dir, self._part), self._schema
+            )
+
+        table = pa.Table.from_pydict(self._columns, schema=self._schema)
+        self._writer.write_table(table, row_group_size=self.row_group_size)
+        self._columns = {k: [] for k in self._schema.names}
+
+    def _close_part(self):
+        self._write_row_group()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._meta["parts"].append(self._part)
+            self._save_meta()
+
+    def _save_meta(self):
+        self._meta["num-samples"] = self._count
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump(self._meta, f, indent=2)
+
+
+class ShardedDataset(Dataset):
+    """
+    Read dataset written by multiple writer processes (main.py --num_writers) as one dataset.
+    Each shard is a LmdbDataset or ImgDataset in a sub directory of data_dir with its own names
+    start from 000000000. Shard i covers global names [sum(num-samples of shard 0~i-1), ...)
+
+    manifest.json format:
+
+    .. code-block:: bash
+
+        {
+            "dataset": "lmdb",
+            "shards": [
+                {"dir": "shard_000", "num-samples": 2},
+                {"dir": "shard_001", "num-samples": 3}
+            ],
+            "num-samples": 5
+        }
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, data_dir: str):
+        super().__init__(data_dir)
+        with open(os.path.join(data_dir, self.MANIFEST_NAME), "r", encoding="utf-8") as f:
+            self._manifest = json.load(f)
+
+        dataset_cls = DATASETS[self._manifest["dataset"]]
+        shards = self._manifest["shards"]
+        self._shards = [dataset_cls(os.path.join(data_dir, it["dir"])) for it in shards]
+        self._offsets = list(accumulate([0] + [it["num-samples"] for it in shards]))
+
+    @staticmethod
+    def shard_dir(shard_id: int) -> str:
+        return f"shard_{shard_id:03d}"
+
+    @classmethod
+    def is_sharded(cls, data_dir: str) -> bool:
+        return os.path.exists(os.path.join(data_dir, cls.MANIFEST_NAME))
+
+    @classmethod
+    def write_manifest(cls, data_dir: str, dataset: str) -> int:
+        """
+        Collect all shard directories in data_dir into manifest.json
+
+        Args:
+            data_dir: directory contains shard directories
+            dataset: key of DATASETS, e.g: "lmdb"
+
+        Returns:
+            total count of all shards
+        """
+        shards = []
+        for d in sorted(os.listdir(data_dir)):
+            shard_path = os.path.join(data_dir, d)
+            if not d.startswith("shard_") or not os.path.isdir(shard_path):
+                continue
+            with DATASETS[dataset](shard_path) as db:
+                shards.append({"dir": d, "num-samples": db.read_count()})
+
+        count = sum(it["num-samples"] for it in shards)
+        manifest = {"dataset": dataset, "shards": shards, "num-samples": count}
+        with open(os.path.join(data_dir, cls.MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return count
+
+    def read(self, name: str) -> Dict:
+        shard, local_name = self._locate(name)
+        return shard.read(local_name)
+
+    def read_size(self, name: str) -> [int, int]:
+        shard, local_name = self._locate(name)
+        return shard.read_size(local_name)
+
+    def read_count(self) -> int:
+        return self._offsets[-1]
+
+    def close(self):
+        for shard in self._shards:
+            shard.__exit__(None, None, None)
+
+    def _locate(self, name: str):
+        index = int(name)
+        if index < 0 or index >= self.read_count():
+            raise KeyError(f"{name} not in range({self.read_count()})")
+        shard_idx = bisect_right(self._offsets, index) - 1
+        local_name = "{:09d}".format(index - self._offsets[shard_idx])
+        return self._shards[shard_idx], local_name
+
+
+DATASETS = {
+    "lmdb": LmdbDataset,
+    "img": ImgDataset,
+    "packed": PackedDataset,
+    "tar": TarShardDataset,
+    "parquet": ParquetDataset,
+}
+
+
 if __name__ == "__main__":
     # image = cv2.imread("f_004.jpg")
     # label = "test"
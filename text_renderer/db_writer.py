@@ -4,9 +4,11 @@ Created on Sun Aug  6 00:25:19 2023
 
 @author: kunth
 """
-import time
+import tempfile
+import threading
+from array import array
 import numpy as np
-from typing import List, Dict
+from typing import Dict, Iterator, Tuple
 from abc import abstractmethod
 from loguru import logger
 from text_renderer.dataset import ImgDataset
@@ -20,53 +22,229 @@ class DBWriter():
     def write_count(self, count: int):
         pass
 
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+class ByteArena:
+    """
+    Growing uint8 buffer. When it grows larger than memory_budget bytes,
+    it is moved to a memory-mapped temporary file in spill_dir.
+    Views returned by view() stay valid after the buffer grows.
+    """
+
+    def __init__(self, memory_budget: int = -1, spill_dir: str = None, capacity: int = 1 << 20):
+        """
+
+        Parameters
+        ----------
+        memory_budget : int
+            Max bytes kept in memory, set -1 to never spill to disk
+        spill_dir : str
+            Directory of the memory-mapped file, default is system temp directory
+        capacity : int
+            Initial capacity in bytes
+        """
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._buf = np.empty(capacity, dtype=np.uint8)
+        self._size = 0
+        self._spill_file = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._spill_file is not None
+
+    @property
+    def nbytes(self) -> int:
+        return self._size
+
+    def append(self, data: np.ndarray) -> int:
+        """
+        Returns:
+            offset of data in arena
+        """
+        data = data.reshape(-1)
+        offset = self._size
+        end = offset + data.size
+        if end > self._buf.size:
+            self._grow(end)
+        self._buf[offset:end] = data
+        self._size = end
+        return offset
+
+    def view(self, offset: int, nbytes: int) -> np.ndarray:
+        return self._buf[offset : offset + nbytes]
+
+    def close(self):
+        self._buf = np.empty(0, dtype=np.uint8)
+        self._size = 0
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _grow(self, min_capacity: int):
+        capacity = max(self._buf.size * 2, min_capacity)
+        if not self.spilled and (
+            self.memory_budget == -1 or capacity <= self.memory_budget
+        ):
+            buf = np.empty(capacity, dtype=np.uint8)
+            buf[: self._size] = self._buf[: self._size]
+            self._buf = buf
+            return
+
+        old_buf = None
+        if self.spilled:
+            self._buf.flush()
+        else:
+            self._spill_file = tempfile.TemporaryFile(dir=self.spill_dir, suffix=".arena")
+            old_buf = self._buf
+
+        self._spill_file.truncate(capacity)
+        self._buf = np.memmap(self._spill_file, dtype=np.uint8, mode="r+", shape=(capacity,))
+        if old_buf is not None:
+            self._buf[: self._size] = old_buf[: self._size]
+
+
 class DBMemoryWriter(DBWriter):
-    _images : List[Dict[str, np.ndarray]]
-    _labels : List[Dict[str, str]]
-    
-    def __init__(self, render: Render):
+    """
+    Keep rendered images in memory. Image pixels are packed into one growing buffer,
+    names and labels are packed into a string table. When the image buffer grows larger than
+    memory_budget bytes, it spills to a memory-mapped temporary file in spill_dir.
+    write() can be called from multiple threads.
+    """
+
+    # image_offset, height, width, channels(0 for 2D image), name_offset, name_end(label_offset), label_end
+    _RECORD_SIZE = 7
+
+    def __init__(self, render: Render, memory_budget: int = -1, spill_dir: str = None):
         super().__init__()
-        self._images = []
-        self._labels = []
-        
+        self._images = ByteArena(memory_budget, spill_dir)
+        self._strings = ByteArena()
+        self._records = array("q")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._records) // self._RECORD_SIZE
+
+    @property
+    def spilled(self) -> bool:
+        return self._images.spilled
+
     def write(self, name: str, image: np.ndarray, label: str):
-        self._images.append({name: image})
-        self._labels.append({name: label})
-    
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 0
+        name_bytes = name.encode()
+        strings = np.frombuffer(name_bytes + label.encode(), dtype=np.uint8)
+
+        with self._lock:
+            image_offset = self._images.append(image)
+            name_offset = self._strings.append(strings)
+            self._records.extend(
+                (
+                    image_offset,
+                    height,
+                    width,
+                    channels,
+                    name_offset,
+                    name_offset + len(name_bytes),
+                    name_offset + strings.size,
+                )
+            )
+
     def write_count(self, count: int):
         pass
-    
-    def get_images(self) -> Dict[str, np.ndarray()]:
-        return {k: v for d in self._images for k, v in d.items()}
-    
+
+    def iter_images(self) -> Iterator[Tuple[str, np.ndarray, str]]:
+        """
+        Iterate (name, image, label) of written images, image is a view of the buffer without copy
+        """
+        for i in range(len(self)):
+            yield self._read(i)
+
+    def get_images(self) -> Dict[str, np.ndarray]:
+        return {name: image for name, image, _ in self.iter_images()}
+
     def get_labes(self) -> Dict[str, str]:
-        return {k: v for d in self._labels for k, v in d.items()}
-    
-    
-    
+        return {name: label for name, _, label in self.iter_images()}
+
+    def close(self):
+        with self._lock:
+            self._images.close()
+            self._strings.close()
+            self._records = array("q")
+
+    def _read(self, i: int) -> Tuple[str, np.ndarray, str]:
+        start = i * self._RECORD_SIZE
+        (
+            image_offset,
+            height,
+            width,
+            channels,
+            name_offset,
+            label_offset,
+            label_end,
+        ) = self._records[start : start + self._RECORD_SIZE]
+
+        shape = (height, width, channels) if channels != 0 else (height, width)
+        nbytes = height * width * max(channels, 1)
+        image = self._images.view(image_offset, nbytes).reshape(shape)
+
+        name = self._strings.view(name_offset, label_offset - name_offset).tobytes().decode()
+        label = self._strings.view(label_offset, label_end - label_offset).tobytes().decode()
+        return name, image, label
+
 
 class DBFileWriter(DBWriter):
-    def __init__( self, render: Render, save_dir: str, label_filename: str = None):
+    """
+    Keep one ImgDataset open for all writes, labels are flushed to the label log every
+    flush_interval images, or when flush()/close() is called.
+    write() can be called from multiple threads. Multiple DBFileWriter can share a save_dir,
+    use different label_filename for each of them.
+    """
+
+    def __init__(
+        self,
+        render: Render,
+        save_dir: str,
+        label_filename: str = None,
+        flush_interval: int = 1000,
+    ):
         super().__init__()
         self.save_dir = str(save_dir)
         self.render = render
         self.label_filename = label_filename
+        self.flush_interval = flush_interval
+        self._db = ImgDataset(self.save_dir, self.label_filename, flush_interval)
+        self._lock = threading.Lock()
 
     def write(self, name: str, image: np.ndarray, label: str):
         try:
-            with ImgDataset(self.save_dir, self.label_filename) as db:
-                db.write(name, image, label)
-                
+            height, width = image.shape[:2]
+            image_bytes = self._db.encode(image)
+            with self._lock:
+                self._db.write_bytes(name, image_bytes, label, (width, height))
         except Exception as e:
-            logger.exception("DBFielWriter error")
+            logger.exception("DBFileWriter error")
             raise e
 
     def write_count(self, count: int):
-        with ImgDataset(self.save_dir, self.label_filename) as db:
-            db.write_count(count)
-    
-    
-    
+        with self._lock:
+            self._db.write_count(count)
+
+    def flush(self):
+        with self._lock:
+            self._db.flush()
+
     def run(self, save_dir, num_image=100, offset=0):
         
         # log_period = max(1, int(self.log_period / 100 * num_image))
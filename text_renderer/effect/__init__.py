@@ -1,4 +1,4 @@
-from .base_effect import Effect, Effects, NoEffects
+from .base_effect import Effect, Effects, NoEffects, record_applied_effects
 from .selector import OneOf
 from .dropout_rand import DropoutRand
 from .dropout_horizontal import DropoutHorizontal
@@ -12,6 +12,7 @@ __all__ = [
     "Effect",
     "Effects",
     "NoEffects",
+    "record_applied_effects",
     "OneOf",
     "DropoutRand",
     "DropoutHorizontal",
@@ -1,8 +1,8 @@
 import random
+import threading
 from abc import abstractmethod
-from typing import List, Union, Tuple
-
-from PIL import PyAccess
+from contextlib import contextmanager
+from typing import Iterator, List, Union, Tuple
 
 from text_renderer.effect.selector import Selector
 from text_renderer.utils.bbox import BBox
@@ -10,6 +10,29 @@ from text_renderer.utils.types import PILImage
 from text_renderer.utils.utils import prob
 
 
+_applied_effects = threading.local()
+
+
+@contextmanager
+def record_applied_effects() -> Iterator[List[str]]:
+    """
+    Collect class names of effects applied in current thread
+
+    .. code-block:: python
+
+        with record_applied_effects() as effect_names:
+            render(font_text)
+        print(effect_names)  # ["Line", "DropoutRand"]
+    """
+    names = []
+    prev_names = getattr(_applied_effects, "names", None)
+    _applied_effects.names = names
+    try:
+        yield names
+    finally:
+        _applied_effects.names = prev_names
+
+
 class Effect:
     """
     Apply different augmentations to image.
@@ -30,6 +53,9 @@ class Effect:
 
     def __call__(self, img, text_bbox):
         if prob(self.p):
+            names = getattr(_applied_effects, "names", None)
+            if names is not None:
+                names.append(self.__class__.__name__)
             return self.apply(img, text_bbox)
         return img, text_bbox
 
@@ -65,22 +91,17 @@ class Effect:
         Parameters
         ----------
         pim : PyAccess
-            Get from pil_img.load()
+            Get from pil_img.load(), RGBA or LA image
         col : int
         row : int
         """
 
-        pim[col, row] = (
-            random.randint(0, pim[col, row][0]),
-            random.randint(0, pim[col, row][1]),
-            random.randint(0, pim[col, row][2]),
-            random.randint(0, pim[col, row][3]),
-        )
+        pim[col, row] = tuple(random.randint(0, v) for v in pim[col, row])
 
     @staticmethod
     def fix_pick(pim, col, row, value_range: Tuple[int, int]):
         value = random.randint(*value_range)
-        pim[col, row] = (value, value, value, value)
+        pim[col, row] = (value,) * len(pim[col, row])
 
 
 class NoEffects:
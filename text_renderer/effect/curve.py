@@ -1,10 +1,11 @@
+from functools import lru_cache
 from typing import Tuple
 
 import cv2
 import numpy as np
-from PIL import Image
 
 from text_renderer.utils.bbox import BBox
+from text_renderer.utils.draw_utils import array_to_pil
 from text_renderer.utils.types import PILImage
 from .base_effect import Effect
 
@@ -15,6 +16,7 @@ class Curve(Effect):
         p=0.5,
         period: float = 180,
         amplitude: Tuple[float, float] = (1, 5),
+        amplitude_step: float = 0.1,
     ):
         """
 
@@ -25,49 +27,64 @@ class Curve(Effect):
         period : float
             in degree
         amplitude : tuple
+        amplitude_step : float
+            Random amplitude is rounded to multiple of amplitude_step, so remap maps
+            can be cached per (width, height, period, amplitude)
         """
 
         super().__init__(p)
         assert amplitude[0] < amplitude[1]
+        assert amplitude_step > 0
         self.period = period
         self.amplitude = amplitude
+        self.amplitude_step = amplitude_step
 
     def apply(self, img: PILImage, text_bbox: BBox) -> Tuple[PILImage, BBox]:
         max_val = np.random.uniform(*self.amplitude)
+        max_val = round(max_val / self.amplitude_step) * self.amplitude_step
 
         word_img = np.array(img)
         h, w = word_img.shape[:2]
 
-        img_x = np.zeros((h, w), np.float32)
-        img_y = np.zeros((h, w), np.float32)
+        img_x, img_y, offsets = _get_remap_maps(w, h, self.period, max_val)
 
         xmin = text_bbox.left
         xmax = text_bbox.right
         ymin = text_bbox.top
         ymax = text_bbox.bottom
 
+        # rows of bbox edges are moved by offsets of every column, if they are in image
         remap_y_min = ymin
         remap_y_max = ymax
-
-        for y in range(h):
-            for x in range(w):
-                remaped_y = y + self._remap_y(x, max_val)
-
-                if y == ymin:
-                    if remaped_y < remap_y_min:
-                        remap_y_min = remaped_y
-
-                if y == ymax:
-                    if remaped_y > remap_y_max:
-                        remap_y_max = remaped_y
-
-                img_y[y, x] = remaped_y
-                img_x[y, x] = x
+        if 0 <= ymin < h and w != 0:
+            remap_y_min = min(ymin, ymin + int(offsets.min()))
+        if 0 <= ymax < h and w != 0:
+            remap_y_max = max(ymax, ymax + int(offsets.max()))
 
         dst = cv2.remap(word_img, img_x, img_y, cv2.INTER_CUBIC)
         bbox = BBox(left=xmin, top=remap_y_min, right=xmax, bottom=remap_y_max)
         bbox = bbox.offset((bbox.left, bbox.top), (0, 0))
-        return Image.fromarray(dst), bbox
-
-    def _remap_y(self, x, max_val):
-        return int(max_val * np.math.sin(2 * 3.14 * x / self.period))
+        return array_to_pil(dst, img.mode), bbox
+
+
+@lru_cache(maxsize=64)
+def _get_remap_maps(
+    width: int, height: int, period: float, max_val: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns:
+        img_x, img_y: (height, width) float32 maps of cv2.remap, readonly because they are shared
+        offsets: (width,) int y offset of every column
+    """
+    x = np.arange(width)
+    # same as int(max_val * sin(...)) of every column
+    offsets = (max_val * np.sin(2 * 3.14 * x / period)).astype(int)
+
+    img_x = np.empty((height, width), np.float32)
+    img_x[...] = x
+    img_y = np.empty((height, width), np.float32)
+    img_y[...] = np.arange(height)[:, None] + offsets
+
+    for arr in (img_x, img_y, offsets):
+        arr.flags.writeable = False
+    return img_x, img_y, offsets
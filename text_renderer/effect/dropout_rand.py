@@ -4,6 +4,7 @@ from typing import Tuple
 import numpy as np
 
 from text_renderer.utils.bbox import BBox
+from text_renderer.utils.draw_utils import array_to_pil
 from text_renderer.utils.types import PILImage
 
 from .base_effect import Effect
@@ -25,10 +26,11 @@ class DropoutRand(Effect):
         self.dropout_p = dropout_p
 
     def apply(self, img: PILImage, text_bbox: BBox) -> Tuple[PILImage, BBox]:
-        pim = img.load()
-
-        alpha_channel = np.array(img).astype(np.uint8)[:, :, 3]
-        nonzero_idxes = np.argwhere(alpha_channel != 0)
+        np_img = np.array(img)
+        # view of (pixels, channels), L image has one channel used as alpha
+        channels = np_img.shape[2] if np_img.ndim == 3 else 1
+        pixels = np_img.reshape(-1, channels)
+        nonzero_idxes = np.flatnonzero(pixels[:, -1])
 
         nonzero_count = nonzero_idxes.shape[0]
         random_dropout_count = random.randint(
@@ -36,12 +38,10 @@ class DropoutRand(Effect):
             int(nonzero_count * self.dropout_p[1]),
         )
         shuffled = np.random.permutation(nonzero_count)
-        shuffled = shuffled[:random_dropout_count]
+        dropout_idxes = nonzero_idxes[shuffled[:random_dropout_count]]
 
-        for i in shuffled:
-            y, x = nonzero_idxes[i]
-            col = int(x)
-            row = int(y)
-            self.rand_pick(pim, col, row)
+        # same as Effect.rand_pick: random.randint(0, v) of every channel
+        values = pixels[dropout_idxes].astype(np.int16)
+        pixels[dropout_idxes] = np.random.randint(0, values + 1, dtype=np.int16)
 
-        return img, text_bbox
+        return array_to_pil(np_img, img.mode), text_bbox
@@ -1,6 +1,8 @@
-import random
 from typing import Tuple
 
+import numpy as np
+from PIL import Image
+
 from text_renderer.utils.bbox import BBox
 from text_renderer.utils.types import PILImage
 
@@ -24,12 +26,25 @@ class DropoutVertical(Effect):
         self.thickness = thickness
 
     def apply(self, img: PILImage, text_bbox: BBox) -> Tuple[PILImage, BBox]:
-        pim = img.load()
-
-        for _ in range(self.num_line):
-            col = random.randint(1, img.width - self.thickness - 1)
-            for i in range(self.thickness):
-                for row in range(img.height):
-                    self.fix_pick(pim, col + i, row, (0, 20))
+        if img.width == 0 or img.height == 0:
+            return img, text_bbox
+
+        max_col = img.width - self.thickness - 1
+        if max_col >= 1:
+            cols = np.random.randint(1, max_col + 1, self.num_line)
+        else:
+            # image is narrower than thickness + 2, lines are clipped to image
+            cols = np.random.randint(0, max(max_col + 2, 1), self.num_line)
+
+        # same as Effect.fix_pick with value range (0, 20) on every pixel of the lines.
+        # Only the lines are pasted on image, so cost does not depend on image width
+        values = np.random.randint(
+            0, 21, (self.num_line, img.height, self.thickness), dtype=np.uint8
+        )
+        bands = len(img.getbands())
+        for col, value in zip(cols, values):
+            value = np.ascontiguousarray(value[:, : img.width - col])
+            line = Image.frombytes("L", (value.shape[1], value.shape[0]), value.tobytes())
+            img.paste(Image.merge(img.mode, [line] * bands), (int(col), 0))
 
         return img, text_bbox
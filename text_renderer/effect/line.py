@@ -5,7 +5,7 @@ import numpy as np
 from PIL import ImageDraw
 
 from text_renderer.utils.bbox import BBox
-from text_renderer.utils.draw_utils import transparent_img
+from text_renderer.utils.draw_utils import color_for_mode, transparent_img
 from text_renderer.utils.types import PILImage
 
 if typing.TYPE_CHECKING:
@@ -105,7 +105,7 @@ class Line(Effect):
         new_w = img.width
         new_h = img.height + thickness + in_offset + out_offset
 
-        new_img = transparent_img((new_w, new_h))
+        new_img = transparent_img((new_w, new_h), img.mode)
         new_img.paste(img, (0, 0))
 
         draw = ImageDraw.Draw(new_img)
@@ -128,7 +128,7 @@ class Line(Effect):
         new_w = img.width
         new_h = img.height + thickness + in_offset
 
-        new_img = transparent_img((new_w, new_h))
+        new_img = transparent_img((new_w, new_h), img.mode)
         new_img.paste(img, (0, thickness + in_offset + out_offset))
 
         draw = ImageDraw.Draw(new_img)
@@ -152,7 +152,7 @@ class Line(Effect):
         new_w = img.width + thickness + in_offset + out_offset
         new_h = img.height
 
-        new_img = transparent_img((new_w, new_h))
+        new_img = transparent_img((new_w, new_h), img.mode)
         new_img.paste(img, (0, 0))
 
         draw = ImageDraw.Draw(new_img)
@@ -175,7 +175,7 @@ class Line(Effect):
         new_w = img.width + thickness + in_offset + out_offset
         new_h = img.height
 
-        new_img = transparent_img((new_w, new_h))
+        new_img = transparent_img((new_w, new_h), img.mode)
         new_img.paste(img, (thickness + in_offset + out_offset, 0))
 
         draw = ImageDraw.Draw(new_img)
@@ -229,11 +229,12 @@ class Line(Effect):
     def _get_line_color(self, img: PILImage, text_bbox: BBox):
         if self.color_cfg is not None:
             # TODO: pass background image
-            return self.color_cfg.get_color(img)
+            return color_for_mode(self.color_cfg.get_color(img), img.mode)
 
-        return (
+        color = (
             np.random.randint(0, 170),
             np.random.randint(0, 170),
             np.random.randint(0, 170),
             np.random.randint(90, 255),
         )
+        return color_for_mode(color, img.mode)
@@ -39,7 +39,7 @@ class Padding(Effect):
         new_w = int(img.width + img.width * w_ratio)
         new_h = int(img.height + img.height * h_ratio)
 
-        new_img = transparent_img((new_w, new_h))
+        new_img = transparent_img((new_w, new_h), img.mode)
 
         if self.center:
             xy = (int((new_w - img.width) / 2), int((new_h - img.height) / 2))
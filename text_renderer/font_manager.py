@@ -14,6 +14,20 @@ from text_renderer.utils.errors import PanicError
 from text_renderer.utils.utils import load_chars_file
 
 
+def get_font(font_path: str, font_size: int, index: int = 0) -> FreeTypeFont:
+    """
+    Shared by FontManager and Render, so a (font_path, font_size) is loaded once
+    and its glyph tables are reused
+    """
+    # always pass all args, lru_cache keys f(a, b) and f(a, b, 0) differently
+    return _load_font(font_path, font_size, index)
+
+
+@lru_cache()
+def _load_font(font_path: str, font_size: int, index: int) -> FreeTypeFont:
+    return ImageFont.truetype(font_path, font_size, index=index)
+
+
 class FontManager:
     def __init__(
         self, font_dir: Path, font_list_file: Optional[Path], font_size: Tuple[int, int]
@@ -189,7 +203,5 @@ class FontManager:
 
             return ttf
 
-    @lru_cache()
     def _get_font(self, font_path: str, font_size: int) -> FreeTypeFont:
-        font = ImageFont.truetype(font_path, font_size)
-        return font
+        return get_font(font_path, font_size)
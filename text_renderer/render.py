@@ -1,3 +1,5 @@
+import inspect
+import random
 from typing import Tuple, List
 
 from PIL import Image
@@ -10,13 +12,20 @@ from PIL.ImageFont import FreeTypeFont
 from tenacity import retry
 
 from text_renderer.bg_manager import BgManager
+from text_renderer.font_manager import get_font
 from text_renderer.effect import DropoutRand, DropoutVertical, Effects, Line, OneOf
 from text_renderer.config import RenderCfg, NormPerspectiveTransformCfg, FixedTextColorCfg
-from text_renderer.utils.draw_utils import draw_text_on_bg, transparent_img
+from text_renderer.utils.draw_utils import (
+    array_to_pil,
+    composite_text_mask,
+    draw_text_on_bg,
+    transparent_img,
+)
 from text_renderer.utils import utils
 from text_renderer.utils.errors import PanicError
-from text_renderer.utils.math_utils import PerspectiveTransform
+from text_renderer.utils.math_utils import PerspectiveTransform, WarpMatrixBank, warp_perspective
 from text_renderer.utils.bbox import BBox
+from text_renderer.utils.cluster_cache import ClusterCache
 from text_renderer.utils.font_text import FontText
 from text_renderer.utils.types import FontColor, is_list
 
@@ -25,117 +34,222 @@ class Render:
     def __init__(self, render_config: RenderCfg):
         self.render_config = render_config
         self.layout = render_config.layout
-        self.bg_manager = BgManager(render_config.bg_dir, render_config.pre_load_bg_img)
+        self.bg_manager = BgManager(
+            render_config.bg_dir, render_config.pre_load_bg_img, render_config.gray
+        )
+        # text mask is LA image when gray, so every stage works on 2 channels
+        self.mode = "LA" if render_config.gray else "RGBA"
+        # mode of background and final image
+        self.bg_mode = "L" if render_config.gray else "RGBA"
+        self.cluster_cache = None
+        if render_config.cluster_cache_size > 0:
+            self.cluster_cache = ClusterCache(render_config.cluster_cache_size)
+        self.warp_bank = None
+        perspective_transform = render_config.perspective_transform
+        if perspective_transform is not None and perspective_transform.bank_size > 0:
+            height = render_config.height if render_config.height != -1 else 32
+            self.warp_bank = WarpMatrixBank(perspective_transform, height)
+        self.perspective_growth = 1.0
+        if render_config.fit_font_size and perspective_transform is not None:
+            self.perspective_growth = self._get_perspective_growth()
+        # TextColorCfg subclasses written before get_color took bg_stats/region
+        self.color_cfg_takes_region = render_config.text_color_cfg is not None and (
+            self._accepts_kwargs(render_config.text_color_cfg.get_color, ["bg_stats", "region"])
+        )
 
     @retry
     def __call__(self, font_text: FontText) -> Tuple[np.ndarray, str]:
         try:
             img, text, cropped_bg, transformed_text_mask = self.gen_single_corpus(font_text)
 
-            if img.size == (0,0): 
-                return np.array(img), text
-            
+            if img.size == 0:
+                return img, text
+
             if self.render_config.render_effects is not None:
-                img, _ = self.render_config.render_effects.apply_effects(
-                    img, BBox.from_size(img.size)
+                # effects work on LA/RGBA images like corpus effects, alpha added to
+                # gray image is dropped afterwards (same as RGBA image converted to RGB)
+                pil_img = array_to_pil(img, self.bg_mode).convert(self.mode)
+                pil_img, _ = self.render_config.render_effects.apply_effects(
+                    pil_img, BBox.from_size(pil_img.size)
                 )
+                img = np.array(pil_img.convert(self.bg_mode))
 
             if self.render_config.return_bg_and_mask:
-                gray_text_mask = np.array(transformed_text_mask.convert("L"))
+                gray_text_mask = np.array(Image.fromarray(transformed_text_mask).convert("L"))
                 _, gray_text_mask = cv2.threshold(
                     gray_text_mask, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU
                 )
-                transformed_text_mask = Image.fromarray(255 - gray_text_mask)
-
-                merge_target = Image.new("RGBA", (img.width * 3, img.height))
-                merge_target.paste(img, (0, 0))
-                merge_target.paste(cropped_bg, (img.width, 0))
-                merge_target.paste(
-                    transformed_text_mask,
-                    (img.width * 2, 0),
-                    mask=transformed_text_mask,
-                )
+                gray_text_mask = 255 - gray_text_mask
+                if img.ndim == 3:
+                    gray_text_mask = np.repeat(gray_text_mask[:, :, None], img.shape[2], axis=2)
+
+                # render effects may change size of img, other parts are clipped like paste
+                height, width = img.shape[:2]
+                merge_target = np.zeros((height, width * 3) + img.shape[2:], dtype=np.uint8)
+                for i, part in enumerate([img, cropped_bg, gray_text_mask]):
+                    part = part[:height, :width]
+                    merge_target[: part.shape[0], width * i : width * i + part.shape[1]] = part
 
-                np_img = np.array(merge_target)
-                np_img = cv2.cvtColor(np_img, cv2.COLOR_RGBA2BGR)
-                np_img = self.norm(np_img)
+                np_img = self.to_np_img(merge_target)
             else:
-                img = img.convert("RGB")
-                np_img = np.array(img)
-                np_img = cv2.cvtColor(np_img, cv2.COLOR_RGB2BGR)
-                np_img = self.norm(np_img)
+                np_img = self.to_np_img(img)
             return np_img, text
         except Exception as e:
             logger.exception(e)
             raise e
 
-    def gen_single_corpus(self, font_text: FontText) -> Tuple[PILImage, str, PILImage, PILImage]:
+    def gen_single_corpus(
+        self, font_text: FontText
+    ) -> Tuple[np.ndarray, str, np.ndarray, np.ndarray]:
+        """
+        Returns:
+            img: L or RGBA numpy image of text pasted on background
+            text:
+            cropped_bg: region of background under text, same shape as img
+            transformed_text_mask: LA or RGBA numpy text mask after effects and perspective transform
+        """
         # font_text = self.corpus.sample()
 
-        bg = self.bg_manager.get_bg()
-        text_color =  (255, 50, 0, 255)
-        if self.render_config.text_color_cfg is not None:
-            text_color = self.render_config.text_color_cfg.get_color(bg)
+        background = self.bg_manager.sample()
+        bg, bg_stats = background.img, background.stats
 
         char_spacing= -1 #self.corpus.render_config.char_spacing
-        text_mask = draw_text_on_bg(font_text, text_color, char_spacing )
+        if self.render_config.fit_font_size and self.render_config.height != -1:
+            self.fit_font_size(font_text)
+        if self.cluster_cache is not None and font_text.horizontal:
+            font_text.rasterize(self.cluster_cache)
+
+        # Relative position of text on bg is chosen before drawing text,
+        # so text color can be chosen from the region text will be pasted on
+        if self.render_config.placement_cfg is not None:
+            placement = self.render_config.placement_cfg.get_placement(bg_stats, font_text.size)
+        else:
+            placement = (random.random(), random.random())
+        text_color =  (255, 50, 0, 255)
+        if self.render_config.text_color_cfg is not None:
+            if self.color_cfg_takes_region:
+                region = self.get_text_region(bg, font_text, placement)
+                text_color = self.render_config.text_color_cfg.get_color(
+                    bg, bg_stats=bg_stats, region=region
+                )
+            else:
+                text_color = self.render_config.text_color_cfg.get_color(bg)
+        text_mask = draw_text_on_bg(font_text, text_color, char_spacing, self.mode)
 
         if self.render_config.corpus_effects is not None and text_mask.size != (0, 0):
             text_mask, _ = self.render_config.corpus_effects.apply_effects(
                 text_mask, BBox.from_size(text_mask.size)
             )
 
+        # text mask is numpy image from here, so it is not converted again when pasted
+        transformed_text_mask = np.asarray(text_mask)
         if self.render_config.perspective_transform is not None:
-            if text_mask.size == (0, 0):
-                transformed_text_mask = text_mask
-            else:
-                transformer = PerspectiveTransform(self.render_config.perspective_transform)
-                # TODO: refactor this, now we must call get_transformed_size to call gen_warp_matrix
-                _ = transformer.get_transformed_size(text_mask.size)
-                
-                
+            if text_mask.size != (0, 0):
+                if self.warp_bank is not None:
+                    sample = self.warp_bank.sample(text_mask.size)
+                else:
+                    transformer = PerspectiveTransform(self.render_config.perspective_transform)
+                    sample = transformer.sample(text_mask.size)
                 try:
                     (
                         transformed_text_mask,
                         transformed_text_pnts,
-                    ) = transformer.do_warp_perspective(text_mask)
+                    ) = warp_perspective(transformed_text_mask, sample)
                 except Exception as e:
                     logger.exception(e)
                     logger.error(font_text.font_path, "text", font_text.text)
                     logger.error(f"text: {font_text.text}")
                     logger.error(f"image size: {text_mask.size}")
                     raise e
-        else:
-            transformed_text_mask = text_mask
 
-        img, cropped_bg = self.paste_text_mask_on_bg(bg, transformed_text_mask)
+        img, cropped_bg = self.paste_text_mask_on_bg(
+            bg, transformed_text_mask, placement, background.array
+        )
 
         return img, font_text.text, cropped_bg, transformed_text_mask
 
-    def paste_text_mask_on_bg(self, bg: PILImage, transformed_text_mask: PILImage) -> Tuple[PILImage, PILImage]:
+    def fit_font_size(self, font_text: FontText):
+        """
+        Change font size of horizontal font_text, so its text mask is about
+        RenderCfg.height after perspective transform. Text height is taken from the
+        layout bbox at current font size (no rasterization) and scaled linearly.
+        """
+        if not font_text.horizontal:
+            return
+
+        font = font_text.font
+        left, top, right, bottom = font.getbbox(font_text.text)
+        text_height = bottom - top
+        if text_height <= 0:
+            return
+
+        target_height = self.render_config.height / self.perspective_growth
+        font_size = max(1, int(round(font.size * target_height / text_height)))
+        if font_size != font.size:
+            font_text.set_font(get_font(font_text.font_path, font_size, font.index))
+
+    def _get_perspective_growth(self, num_samples: int = 256) -> float:
+        """
+        Mean height ratio of text mask after/before perspective transform, measured on
+        lines with width of 10 times height
+        """
+        height = self.render_config.height
+        sizes = [(height * 10, height)] * num_samples
+        _, out_sizes, _ = PerspectiveTransform.sample_batch(
+            self.render_config.perspective_transform, sizes
+        )
+        return float(out_sizes[:, 1].mean()) / height
+
+    @staticmethod
+    def _accepts_kwargs(func, names: List[str]) -> bool:
+        params = inspect.signature(func).parameters.values()
+        if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params):
+            return True
+        return all(
+            any(p.name == name and p.kind != inspect.Parameter.POSITIONAL_ONLY for p in params)
+            for name in names
+        )
+
+    def get_text_region(
+        self, bg: PILImage, font_text: FontText, placement: Tuple[float, float]
+    ) -> Tuple[int, int, int, int]:
+        """
+        Estimate region of bg text will be pasted on, from text size before effects
+        and perspective transform.
+
+        Returns:
+            (left, top, right, bottom)
+        """
+        width, height = font_text.size
+        x_offset, y_offset = utils.relative_xy_offset((width, height), bg.size, placement)
+        return x_offset, y_offset, x_offset + width, y_offset + height
+
+    def paste_text_mask_on_bg(
+        self,
+        bg: PILImage,
+        transformed_text_mask: np.ndarray,
+        placement: Tuple[float, float] = None,
+        bg_array: np.ndarray = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Args:
             bg:
-            transformed_text_mask:
+            transformed_text_mask: (h, w, 2) LA or (h, w, 4) RGBA numpy text mask
+            placement: relative position of text on bg, random if None
+            bg_array: pixels of bg, read from bg if None
         Returns:
-
+            img: text mask blended on the region of bg
+            cropped_bg: view of the region in bg_array, bg is not modified
         """
-        x_offset, y_offset = utils.random_xy_offset(transformed_text_mask.size, bg.size)
-        bg = self.bg_manager.guard_bg_size(bg, transformed_text_mask.size)
-        bg = bg.crop(
-            (
-                x_offset,
-                y_offset,
-                x_offset + transformed_text_mask.width,
-                y_offset + transformed_text_mask.height,
-            )
-        )
-        if self.render_config.return_bg_and_mask:
-            _bg = bg.copy()
+        size = (transformed_text_mask.shape[1], transformed_text_mask.shape[0])
+        if placement is None:
+            x_offset, y_offset = utils.random_xy_offset(size, bg.size)
         else:
-            _bg = bg
-        bg.paste(transformed_text_mask, (0, 0), mask=transformed_text_mask)
-        return bg, _bg
+            x_offset, y_offset = utils.relative_xy_offset(size, bg.size, placement)
+        guarded_bg = self.bg_manager.guard_bg_size(bg, size)
+        if guarded_bg is not bg or bg_array is None:
+            bg_array = np.asarray(guarded_bg)
+        return composite_text_mask(bg_array, transformed_text_mask, (x_offset, y_offset))
 
     def get_text_color(self, bg: PILImage, text: str, font: FreeTypeFont) -> FontColor:
         # TODO: better get text color
@@ -155,8 +269,16 @@ class Render:
     def _should_apply_layout(self) -> bool:
         return isinstance(self.corpus, list) and len(self.corpus) > 1
 
+    def to_np_img(self, img: np.ndarray) -> np.ndarray:
+        """
+        Convert final L or RGBA numpy image to gray or BGR numpy image and normalize it
+        """
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGR)
+        return self.norm(img)
+
     def norm(self, image: np.ndarray) -> np.ndarray:
-        if self.render_config.gray:
+        if self.render_config.gray and image.ndim == 3:
             image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
         if self.render_config.height != -1 and self.render_config.height != image.shape[0]:
@@ -171,7 +293,7 @@ class Render:
 
 
 class KhmerTextRender(Render):
-    def __init__(self, bg_dir: str):
+    def __init__(self, bg_dir: str, cluster_cache_size: int = 0):
         super().__init__(RenderCfg(
             bg_dir= bg_dir,
             perspective_transform= NormPerspectiveTransformCfg(20, 20, 1.5),
@@ -179,6 +301,7 @@ class KhmerTextRender(Render):
             layout_effects=None,
             layout=None,
             height=32,
+            cluster_cache_size=cluster_cache_size,
             corpus_effects=Effects(
                 [
                     Line(0.5, color_cfg=FixedTextColorCfg()),
@@ -0,0 +1,180 @@
+import multiprocessing as mp
+import queue
+import threading
+from multiprocessing import util
+from multiprocessing.connection import wait
+from typing import List, Optional
+
+import numpy as np
+
+from text_renderer.utils.errors import PanicError
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+
+class SharedMemoryQueue:
+    """
+    Pass rendered images from render processes to DBWriterProcess through fixed-size
+    slots of one shared memory block. Only slot index, image shape and label are
+    pickled, the consumer gets a numpy view of the slot without copy.
+
+    Images larger than slot_size (or not uint8) are sent through the queue as it is.
+
+    Has the same put/get interface as a multiprocessing queue:
+
+    .. code-block:: python
+
+        q.put({"image": np_img, "label": "text"})
+        m = q.get()  # {"image": np_img_view, "label": "text"}
+
+    The slot used by the view returned from get() is released on the next get() call,
+    so consumer must finish using the image before that.
+
+    Processes attached to the shared memory (e.g. render processes) close it when they
+    exit. Call watch_readers() in the process which starts the consumers, so put() raises
+    instead of blocking forever if a consumer dies.
+    """
+
+    def __init__(
+        self, num_slots: int, slot_size: int, poll_interval: float = 1, ctx=None
+    ):
+        """
+
+        Parameters
+        ----------
+        num_slots : int
+            Number of images can be hold in shared memory at the same time
+        slot_size : int
+            Max bytes of one image, e.g: height * max_width * channels
+        poll_interval : float
+            Seconds put() waits for a free slot before checking consumers are alive
+        ctx :
+            multiprocessing context of the processes using this queue, default context if None
+        """
+        if shared_memory is None:
+            raise PanicError("SharedMemoryQueue (--transport shm) requires Python >= 3.8")
+
+        assert num_slots > 0 and slot_size > 0
+        self.num_slots = num_slots
+        self.slot_size = slot_size
+        self.poll_interval = poll_interval
+        self._shm = shared_memory.SharedMemory(create=True, size=num_slots * slot_size)
+        self._is_owner = True
+        ctx = ctx or mp.get_context()
+        self._free_slots = ctx.Queue()
+        self._data_queue = ctx.Queue()
+        self._reader_exited = ctx.Event()
+        self._used_slot: Optional[int] = None
+
+        for i in range(num_slots):
+            self._free_slots.put(i)
+
+    def __getstate__(self):
+        # mp.Queue can only be pickled when spawning new process
+        return (
+            self._shm.name,
+            self.num_slots,
+            self.slot_size,
+            self.poll_interval,
+            self._free_slots,
+            self._data_queue,
+            self._reader_exited,
+        )
+
+    def __setstate__(self, state):
+        (
+            name,
+            self.num_slots,
+            self.slot_size,
+            self.poll_interval,
+            self._free_slots,
+            self._data_queue,
+            self._reader_exited,
+        ) = state
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._is_owner = False
+        self._used_slot = None
+        # run by multiprocessing when this process exits normally
+        util.Finalize(self, self.close, exitpriority=10)
+
+    def watch_readers(self, processes: List[mp.Process]):
+        """
+        Watch started consumer processes in a daemon thread, once one of them exits,
+        put() raises PanicError instead of waiting for a free slot.
+        """
+        sentinels = [p.sentinel for p in processes]
+
+        def watch():
+            wait(sentinels)
+            self._reader_exited.set()
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    def put(self, item):
+        """
+        Items which are not dict with "image" key (e.g. stop token) are sent as it is.
+        Blocks when all slots are in use, raises PanicError if a consumer has exited.
+        """
+        if not isinstance(item, dict) or not self._fit_slot(item.get("image")):
+            self._data_queue.put(item)
+            return
+
+        image = item["image"]
+        slot = self._get_free_slot()
+        self._slot_view(slot, image.shape)[...] = image
+
+        msg = {k: v for k, v in item.items() if k != "image"}
+        msg["slot"] = slot
+        msg["shape"] = image.shape
+        self._data_queue.put(msg)
+
+    def get(self):
+        self._release_used_slot()
+
+        msg = self._data_queue.get()
+        if not isinstance(msg, dict) or "slot" not in msg:
+            return msg
+
+        slot = msg.pop("slot")
+        msg["image"] = self._slot_view(slot, msg.pop("shape"))
+        self._used_slot = slot
+        return msg
+
+    def close(self):
+        """
+        Close shared memory in current process, it is unlinked if current process created it.
+        All image views returned by get() must be deleted before close.
+        """
+        self._release_used_slot()
+        self._shm.close()
+        if self._is_owner:
+            self._shm.unlink()
+
+    def _get_free_slot(self) -> int:
+        while True:
+            try:
+                return self._free_slots.get(timeout=self.poll_interval)
+            except queue.Empty:
+                if self._reader_exited.is_set():
+                    raise PanicError("SharedMemoryQueue consumer process has exited")
+
+    def _fit_slot(self, image) -> bool:
+        return (
+            isinstance(image, np.ndarray)
+            and image.dtype == np.uint8
+            and image.nbytes <= self.slot_size
+        )
+
+    def _slot_view(self, slot: int, shape) -> np.ndarray:
+        return np.ndarray(
+            shape, dtype=np.uint8, buffer=self._shm.buf, offset=slot * self.slot_size
+        )
+
+    def _release_used_slot(self):
+        if self._used_slot is not None:
+            self._free_slots.put(self._used_slot)
+            self._used_slot = None
@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageFont
+from tenacity import stop_after_attempt
+
+from text_renderer.bg_manager import BgManager, BgStats
+from text_renderer.config import RegionStatsPlacementCfg, RenderCfg, TextColorCfg
+from text_renderer.render import Render
+from text_renderer.utils.font_text import FontText
+from text_renderer.utils.utils import relative_xy_offset
+
+
+def test_bg_stats():
+    np_img = np.random.randint(0, 256, (120, 200, 3), dtype=np.uint8)
+    stats = BgStats(Image.fromarray(np_img).convert("RGBA"), cell_size=1)
+
+    assert np.allclose(stats.mean, np_img.mean(axis=(0, 1)))
+    assert stats.hist.shape == (3, 256)
+    assert np.array_equal(stats.hist[1], np.bincount(np_img[:, :, 1].ravel(), minlength=256))
+
+    region_mean = stats.region_mean((10, 20, 110, 50))
+    assert np.allclose(region_mean, np_img[20:50, 10:110].mean(axis=(0, 1)))
+    # clipped to image
+    assert np.allclose(stats.region_mean((150, 100, 300, 200)), np_img[100:, 150:].mean(axis=(0, 1)))
+
+    gray_stats = BgStats(Image.fromarray(np_img).convert("L"))
+    assert gray_stats.region_mean((0, 0, 10, 10)).shape == (1,)
+
+
+def test_bg_stats_lazy_grid():
+    np_img = np.random.randint(0, 256, (123, 205, 3), dtype=np.uint8)
+    np_img[:, 100:] //= 4
+    stats = BgStats(Image.fromarray(np_img).convert("RGBA"))
+    # nothing is computed until used
+    assert stats._channel_integral is None and stats._lum_integral is None
+
+    mean, std = stats.region_lum((0, 0, 205, 123))
+    lum = np.asarray(Image.fromarray(np_img).convert("L")).astype(float)
+    # whole image is exact, partial edge cells are counted by their pixels
+    assert np.isclose(mean, lum.mean()) and np.isclose(std, lum.std())
+    assert stats._channel_integral is None
+
+    # regions are snapped to cell borders
+    region_mean = stats.region_mean((13, 21, 93, 51))
+    assert np.allclose(region_mean, np_img[24:48, 16:96].mean(axis=(0, 1)))
+    assert np.all(np.abs(region_mean - np_img[21:51, 13:93].mean(axis=(0, 1))) < 10)
+    # region smaller than a cell uses one cell
+    assert np.allclose(stats.region_mean((201, 120, 203, 122)), np_img[120:, 200:].mean(axis=(0, 1)))
+
+
+def test_region_stats_placement():
+    # left half is dark, right half is bright
+    np_img = np.zeros((100, 400), dtype=np.uint8)
+    np_img[:, 200:] = 230
+    stats = BgStats(Image.fromarray(np_img), cell_size=1)
+
+    assert stats.region_lum((0, 0, 100, 100)) == (0, 0)
+    mean, std = stats.region_lum((150, 0, 250, 10))
+    assert mean == 115 and std == 115
+
+    cfg = RegionStatsPlacementCfg(min_mean=200, max_std=10, num_candidates=64)
+    for _ in range(20):
+        x, y = relative_xy_offset((100, 20), stats.size, cfg.get_placement(stats, (100, 20)))
+        assert x >= 200
+
+
+class LegacyColorCfg(TextColorCfg):
+    def get_color(self, bg_img):
+        return 0, 0, 0, 255
+
+
+class RegionColorCfg(TextColorCfg):
+    def __init__(self):
+        self.calls = []
+
+    def get_color(self, bg_img, **kwargs):
+        self.calls.append(kwargs)
+        return 0, 0, 0, 255
+
+
+def test_render_text_color_cfg_signature():
+    example_dir = Path(os.path.abspath(os.path.dirname(__file__))).parent.parent / "example_data"
+    font_path = str(example_dir / "font" / "KhmerOS.ttf")
+    font_text = FontText(ImageFont.truetype(font_path, 30), "ខ្មែរ", font_path)
+
+    for color_cfg in [LegacyColorCfg(), RegionColorCfg()]:
+        render = Render(
+            RenderCfg(bg_dir=example_dir / "bg", gray=True, height=32, text_color_cfg=color_cfg)
+        )
+        img, _ = Render.__call__.retry_with(stop=stop_after_attempt(1))(render, font_text)
+        assert img.shape[0] == 32
+
+    assert set(color_cfg.calls[0]) == {"bg_stats", "region"}
+
+
+def test_guard_bg_size():
+    example_dir = Path(os.path.abspath(os.path.dirname(__file__))).parent.parent / "example_data"
+    bg_manager = BgManager(example_dir / "bg", pre_load=False)
+    for width in range(50, 100):
+        bg = bg_manager.guard_bg_size(Image.new("L", (50, 20)), (width, 10))
+        assert bg.size[0] >= width and bg.size[1] >= 10
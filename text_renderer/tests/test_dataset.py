@@ -1,7 +1,19 @@
+import json
+import os
 from tempfile import TemporaryDirectory
 import numpy as np
+import pytest
 
-from text_renderer.dataset import LmdbDataset
+from text_renderer.dataset import (
+    LmdbDataset,
+    ImgDataset,
+    ShardedDataset,
+    PackedDataset,
+    PackedReader,
+    TarShardDataset,
+    ParquetDataset,
+    encode_jpg,
+)
 
 
 def test_lmdb():
@@ -23,3 +35,260 @@ def test_lmdb():
             assert data["label"] == label
             assert data["size"] == [width, height]
             assert dataset.read_count() == 1
+
+
+def test_img_write_bytes():
+    height, width = 5, 10
+    img = np.random.randint(0, 255, (height, width), dtype=np.uint8)
+    label = "hello"
+    with TemporaryDirectory() as d:
+        name = f"{0:09d}"
+        with ImgDataset(d) as dataset:
+            dataset.write_bytes(name, encode_jpg(img), label, (width, height))
+            dataset.write_count(1)
+
+        with ImgDataset(d) as dataset:
+            data = dataset.read(name)
+            assert data["image"].shape[:2] == (height, width)
+            assert data["label"] == label
+            assert list(data["size"]) == [width, height]
+            assert dataset.read_count() == 1
+
+
+def test_img_flush_without_close():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        dataset = ImgDataset(d, flush_interval=2)
+        for i in range(5):
+            dataset.write(f"{i:09d}", img, str(i))
+        # crash, the last sample is not flushed
+
+        with ImgDataset(d) as dataset:
+            assert dataset.read_count() == 4
+            assert dataset.read(f"{3:09d}")["label"] == "3"
+
+
+def test_sharded():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        for shard_id, count in enumerate([2, 3]):
+            shard_dir = os.path.join(d, ShardedDataset.shard_dir(shard_id))
+            with LmdbDataset(shard_dir) as dataset:
+                for i in range(count):
+                    dataset.write(f"{i:09d}", img, f"{shard_id}-{i}")
+                dataset.write_count(count)
+
+        assert ShardedDataset.write_manifest(d, "lmdb") == 5
+        assert ShardedDataset.is_sharded(d)
+
+        with ShardedDataset(d) as dataset:
+            assert dataset.read_count() == 5
+            assert dataset.read(f"{1:09d}")["label"] == "0-1"
+            assert dataset.read(f"{2:09d}")["label"] == "1-0"
+            assert dataset.read(f"{4:09d}")["label"] == "1-2"
+
+
+def test_sharded_read_size():
+    with TemporaryDirectory() as d:
+        for shard_id, count in enumerate([2, 3]):
+            shard_dir = os.path.join(d, ShardedDataset.shard_dir(shard_id))
+            with LmdbDataset(shard_dir) as dataset:
+                for i in range(count):
+                    img = np.zeros((5 + shard_id, 10 + i), dtype=np.uint8)
+                    dataset.write(f"{i:09d}", img, f"{shard_id}-{i}")
+                dataset.write_count(count)
+        ShardedDataset.write_manifest(d, "lmdb")
+
+        with ShardedDataset(d) as dataset:
+            assert dataset.read_size(f"{1:09d}") == (11, 5)
+            assert dataset.read_size(f"{2:09d}") == (10, 6)
+            assert dataset.read_size(f"{4:09d}") == (12, 6)
+            assert tuple(dataset.read(f"{4:09d}")["size"]) == (12, 6)
+
+
+def test_lmdb_periodic_commit():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        try:
+            with LmdbDataset(d, commit_interval=2) as dataset:
+                for i in range(3):
+                    dataset.write(f"{i:09d}", img, "hello")
+                raise RuntimeError("crash")
+        except RuntimeError:
+            pass
+
+        # only the committed images are kept
+        with LmdbDataset(d) as dataset:
+            assert dataset.read_count() == 2
+            assert dataset.read(f"{1:09d}")["label"] == "hello"
+
+
+def test_lmdb_count_on_close():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        with LmdbDataset(d, commit_interval=10) as dataset:
+            for i in range(15):
+                dataset.write(f"{i:09d}", img, "hello")
+
+        with LmdbDataset(d) as dataset:
+            assert dataset.read_count() == 15
+            assert dataset.read(f"{14:09d}")["label"] == "hello"
+
+
+def test_img_legacy_labels():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        legacy = {
+            "labels": {"000000000": "legacy"},
+            "sizes": {"000000000": [10, 5]},
+            "num-samples": 1,
+        }
+        with open(os.path.join(d, ImgDataset.LABEL_NAME), "w", encoding="utf-8") as f:
+            json.dump(legacy, f)
+
+        with ImgDataset(d) as dataset:
+            assert dataset.read_count() == 1
+            dataset.write(f"{1:09d}", img, "ខ្មែរ")
+            dataset.write_count(2)
+
+        with ImgDataset(d) as dataset:
+            assert dataset.read_count() == 2
+            assert dataset.read(f"{0:09d}")["label"] == "legacy"
+            assert dataset.read(f"{1:09d}")["label"] == "ខ្មែរ"
+            assert dataset.read_size(f"{1:09d}") == [10, 5]
+
+
+def test_packed():
+    images = [
+        np.random.randint(0, 255, (32, w), dtype=np.uint8) for w in (100, 0, 50)
+    ]
+    with TemporaryDirectory() as d:
+        with PackedDataset(d) as dataset:
+            for i, img in enumerate(images):
+                dataset.write(f"{i:09d}", img, f"ខ្មែរ{i}")
+            dataset.write_count(len(images))
+
+        reader = PackedReader(d)
+        assert len(reader) == len(images)
+        for i, img in enumerate(images):
+            image, label = reader[i]
+            assert np.array_equal(image, img)
+            assert label == f"ខ្មែរ{i}"
+        assert list(reader.widths()) == [100, 0, 50]
+        del reader, image
+
+        with PackedDataset(d) as dataset:
+            assert dataset.read_count() == len(images)
+            dataset.write(f"{3:09d}", images[0], "more")
+            assert dataset.read(f"{3:09d}")["label"] == "more"
+            assert dataset.read(f"{0:09d}")["size"] == [100, 32]
+
+
+def test_packed_resume_without_close():
+    img = np.random.randint(0, 255, (32, 20), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        # crashed before close: meta.json is never written, files are closed by gc
+        dataset = PackedDataset(d)
+        for i in range(3):
+            dataset.write(f"{i:09d}", img, f"label{i}")
+        del dataset
+        assert not os.path.exists(os.path.join(d, PackedDataset.META_NAME))
+
+        with PackedDataset(d) as dataset:
+            assert dataset.read_count() == 3
+            dataset.write(f"{3:09d}", img, "label3")
+            assert dataset.read(f"{2:09d}")["label"] == "label2"
+
+        with PackedDataset(d) as dataset:
+            assert dataset.read_count() == 4
+
+
+def test_tar_shard():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        with TarShardDataset(d, samples_per_shard=2) as dataset:
+            for i in range(3):
+                dataset.write(f"{i:09d}", img, f"label{i}")
+            dataset.write_count(3)
+
+        with TarShardDataset(d) as dataset:
+            assert dataset.read_count() == 3
+            dataset.write(f"{3:09d}", img, "label3")
+            dataset.write_count(4)
+            assert dataset.read(f"{3:09d}")["label"] == "label3"
+
+        with TarShardDataset(d) as dataset:
+            samples = list(dataset.iter_samples())
+            assert [it[0] for it in samples] == [f"{i:09d}" for i in range(4)]
+            assert [it[2] for it in samples] == [f"label{i}" for i in range(4)]
+            assert dataset.read(f"{1:09d}")["size"] == [10, 5]
+        assert len(os.listdir(d)) == 4
+
+
+def test_tar_shard_resume_after_kill():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        dataset = TarShardDataset(d, samples_per_shard=2)
+        for i in range(5):
+            dataset.write(f"{i:09d}", img, f"label{i}")
+        # killed while writing shard-000002.tar
+        dataset._tar.fileobj.close()
+        killed_shard = os.path.join(d, "shard-000002.tar")
+        killed_size = os.path.getsize(killed_shard)
+        assert killed_size > 0
+
+        with TarShardDataset(d) as dataset:
+            assert dataset.read_count() == 4
+            dataset.write(f"{4:09d}", img, "resumed")
+
+        assert os.path.getsize(killed_shard) == killed_size
+        with TarShardDataset(d) as dataset:
+            assert dataset.read_count() == 5
+            samples = list(dataset.iter_samples())
+            assert [it[0] for it in samples] == [f"{i:09d}" for i in range(5)]
+            assert samples[-1][2] == "resumed"
+
+
+def test_parquet():
+    pq = pytest.importorskip("pyarrow.parquet")
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    meta = {"font_path": "font/KhmerOS.ttf", "font_size": 20, "effects": ["Line"]}
+    with TemporaryDirectory() as d:
+        with ParquetDataset(d, row_group_size=2) as dataset:
+            for i in range(3):
+                dataset.write(f"{i:09d}", img, f"label{i}", meta)
+            dataset.write(f"{3:09d}", img, "label3")
+            dataset.write_count(4)
+
+        with ParquetDataset(d) as dataset:
+            assert dataset.read_count() == 4
+            data = dataset.read(f"{2:09d}")
+            assert data["label"] == "label2"
+            assert data["size"] == [10, 5]
+
+        table = pq.read_table(os.path.join(d, "part-000000.parquet"))
+        assert table.column("font_size").to_pylist() == [20, 20, 20, None]
+        assert table.column("effects").to_pylist()[0] == ["Line"]
+
+
+def test_parquet_resume_after_kill():
+    pytest.importorskip("pyarrow.parquet")
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    with TemporaryDirectory() as d:
+        # killed before the footer of part-000000.parquet is written, keep a
+        # reference so the writer isn't closed by gc
+        killed = ParquetDataset(d, row_group_size=2)
+        for i in range(3):
+            killed.write(f"{i:09d}", img, f"label{i}")
+        killed_part = os.path.join(d, "part-000000.parquet")
+        killed_size = os.path.getsize(killed_part)
+        assert killed_size > 0
+
+        with ParquetDataset(d) as dataset:
+            assert dataset.read_count() == 0
+            dataset.write(f"{0:09d}", img, "resumed")
+
+        assert os.path.getsize(killed_part) == killed_size
+        with ParquetDataset(d) as dataset:
+            assert dataset.read_count() == 1
+            assert dataset.read(f"{0:09d}")["label"] == "resumed"
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from text_renderer.dataset import ImgDataset
+from text_renderer.db_writer import DBFileWriter, DBMemoryWriter
+
+
+def test_file_writer_share_dir():
+    img = np.random.randint(0, 255, (5, 10), dtype=np.uint8)
+    num_writers, count = 2, 20
+    with TemporaryDirectory() as d:
+        writers = [
+            DBFileWriter(None, d, f"labels_{i}.json", flush_interval=3)
+            for i in range(num_writers)
+        ]
+
+        def write(i):
+            writers[i % num_writers].write(f"{i:09d}", img, str(i))
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(write, range(count)))
+
+        for i, writer in enumerate(writers):
+            writer.write_count(count // num_writers)
+            writer.close()
+
+        for i in range(num_writers):
+            with ImgDataset(d, f"labels_{i}.json") as dataset:
+                assert dataset.read_count() == count // num_writers
+                for j in range(i, count, num_writers):
+                    assert dataset.read(f"{j:09d}")["label"] == str(j)
+
+
+def test_memory_writer_spill():
+    images = [
+        np.random.randint(0, 255, (32, w), dtype=np.uint8) for w in (100, 0, 50000)
+    ]
+    images.append(np.random.randint(0, 255, (8, 20, 3), dtype=np.uint8))
+
+    writer = DBMemoryWriter(None, memory_budget=1 << 20)
+    for i, img in enumerate(images):
+        writer.write(f"{i:09d}", img, f"ខ្មែរ{i}")
+
+    assert writer.spilled
+    assert len(writer) == len(images)
+    for i, (name, image, label) in enumerate(writer.iter_images()):
+        assert name == f"{i:09d}"
+        assert label == f"ខ្មែរ{i}"
+        assert np.array_equal(image, images[i])
+    assert writer.get_labes()[f"{1:09d}"] == "ខ្មែរ1"
+    writer.close()
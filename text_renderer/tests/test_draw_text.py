@@ -0,0 +1,140 @@
+import gc
+import os
+import weakref
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from text_renderer.utils.cluster_cache import ClusterCache, split_clusters
+from text_renderer.utils.draw_utils import composite_text_mask, draw_text_on_bg, transparent_img
+from text_renderer.utils.font_text import FontText
+from text_renderer.utils.glyph_table import get_glyph_table
+
+CURRENT_DIR = Path(os.path.abspath(os.path.dirname(__file__)))
+FONT_PATH = CURRENT_DIR.parent.parent / "example_data" / "font" / "KhmerOS.ttf"
+
+
+def test_draw_text_same_as_image_draw():
+    font = ImageFont.truetype(str(FONT_PATH), 23)
+    text_color = (10, 200, 30, 180)
+    for text in ["ភាសាខ្មែរ ស្រស់ស្អាត", "hello", " "]:
+        font_text = FontText(font, text, str(FONT_PATH))
+        text_mask = draw_text_on_bg(font_text, text_color)
+
+        expected = transparent_img(font_text.size)
+        ImageDraw.Draw(expected).text(font_text.xy, text, font=font, fill=text_color)
+        assert np.array_equal(np.array(text_mask), np.array(expected))
+
+
+def test_cluster_cache():
+    font = ImageFont.truetype(str(FONT_PATH), 23)
+    cache = ClusterCache()
+    for text in ["សួស្តី ពិភពលោក", "ភាសាខ្មែរ ស្រស់ស្អាត", "សួស្តី"]:
+        mask, offset, bbox = FontText(font, text, str(FONT_PATH)).rasterize(cache)
+        expected_mask, expected_offset, expected_bbox = FontText(
+            font, text, str(FONT_PATH)
+        ).rasterize()
+        assert np.array_equal(mask, expected_mask)
+        assert tuple(offset) == tuple(expected_offset)
+        assert tuple(bbox) == tuple(expected_bbox)
+
+    assert split_clusters("ស្តី ក") == ["ស្តី", " ", "ក"]
+    # the last text only contains cached clusters
+    assert cache.hits >= 3
+    assert 0 < cache.hit_rate < 1
+
+
+def getsize(font, text):
+    # font.getsize is removed in Pillow 10
+    if hasattr(font, "getsize"):
+        return font.getsize(text)
+    left, top, right, bottom = font.getbbox(text)
+    return right - min(left, 0), bottom - min(top, 0)
+
+
+def test_draw_text_with_char_spacing():
+    font = ImageFont.truetype(str(FONT_PATH), 23)
+    text_color = (10, 200, 30, 180)
+    text = "ក្ដី hello"
+    font_text = FontText(font, text, str(FONT_PATH))
+    text_mask = draw_text_on_bg(font_text, text_color, char_spacing=0.1)
+
+    glyph_table = get_glyph_table(font)
+    glyph = glyph_table["k"]
+    assert glyph == (glyph.mask, font.getbbox("k")[:2], getsize(font, "k"))
+
+    spacing = int(0.1 * font_text.size[1])
+    widths = [getsize(font, c)[0] for c in text]
+    expected = transparent_img(
+        (sum(widths) + spacing * (len(text) - 1), max(getsize(font, c)[1] for c in text))
+    )
+    draw = ImageDraw.Draw(expected)
+    x = 0
+    for c, w in zip(text, widths):
+        draw.text((x, -font_text.offset[1]), c, fill=text_color, font=font)
+        x += w + spacing
+    assert np.array_equal(np.array(text_mask), np.array(expected))
+
+
+def test_glyph_table_released_with_font():
+    tables = []
+    for size in range(10, 60):
+        font = ImageFont.truetype(str(FONT_PATH), size)
+        table = get_glyph_table(font)
+        assert get_glyph_table(font) is table
+        assert table["k"].size == getsize(font, "k")
+        tables.append(weakref.ref(table))
+    del font, table
+    gc.collect()
+    assert sum(t() is not None for t in tables) == 0
+
+
+def test_draw_text_gray():
+    font = ImageFont.truetype(str(FONT_PATH), 23)
+    text_color = (10, 200, 30, 180)
+    for horizontal in [True, False]:
+        font_text = FontText(font, "ភាសាខ្មែរ", str(FONT_PATH), horizontal)
+        rgba = draw_text_on_bg(font_text, text_color)
+        la = draw_text_on_bg(font_text, text_color, mode="LA")
+        assert la.mode == "LA"
+
+        expected = np.array(rgba.convert("LA"))
+        ink = expected[..., 1] != 0
+        assert np.array_equal(np.array(la)[..., 1], expected[..., 1])
+        assert np.array_equal(np.array(la)[ink], expected[ink])
+
+
+def test_composite_text_mask_same_as_paste():
+    for mask_mode, bg_mode in [("LA", "L"), ("RGBA", "RGBA")]:
+        bg = Image.fromarray(np.random.randint(0, 256, (60, 80, 3), dtype=np.uint8))
+        bg = bg.convert(bg_mode)
+        channels = len(mask_mode)
+        text_mask = np.random.randint(0, 256, (20, 30, channels), dtype=np.uint8)
+        # fully transparent and fully opaque pixels
+        text_mask[:5, :, -1] = 0
+        text_mask[5:10, :, -1] = 255
+
+        img, cropped_bg = composite_text_mask(np.asarray(bg), text_mask, (40, 25))
+
+        expected = bg.crop((40, 25, 70, 45))
+        assert np.array_equal(cropped_bg, np.asarray(expected))
+        pil_mask = Image.fromarray(text_mask, mask_mode)
+        expected.paste(pil_mask, (0, 0), mask=pil_mask)
+        assert np.array_equal(img, np.asarray(expected))
+
+
+def test_composite_text_mask_out_of_bg():
+    # background 1px shorter and narrower than the text mask
+    for mask_mode, bg_mode in [("LA", "L"), ("RGBA", "RGBA")]:
+        bg = Image.fromarray(np.random.randint(0, 256, (9, 56, 3), dtype=np.uint8))
+        bg = bg.convert(bg_mode)
+        text_mask = np.random.randint(0, 256, (10, 57, len(mask_mode)), dtype=np.uint8)
+
+        img, cropped_bg = composite_text_mask(np.asarray(bg), text_mask, (0, 0))
+
+        expected = bg.crop((0, 0, 57, 10))
+        assert np.array_equal(cropped_bg, np.asarray(expected))
+        pil_mask = Image.fromarray(text_mask, mask_mode)
+        expected.paste(pil_mask, (0, 0), mask=pil_mask)
+        assert np.array_equal(img, np.asarray(expected))
@@ -0,0 +1,171 @@
+import math
+import os
+import random
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image, ImageFont
+from tenacity import stop_after_attempt
+
+from text_renderer.config import FixedTextColorCfg, RenderCfg
+from text_renderer.effect import (
+    DropoutHorizontal,
+    DropoutRand,
+    DropoutVertical,
+    Effects,
+    Emboss,
+    Line,
+    MotionBlur,
+    Padding,
+)
+from text_renderer.effect.curve import Curve, _get_remap_maps
+from text_renderer.render import Render
+from text_renderer.utils.bbox import BBox
+from text_renderer.utils.font_text import FontText
+
+CURRENT_DIR = Path(os.path.abspath(os.path.dirname(__file__)))
+FONT_PATH = CURRENT_DIR.parent.parent / "example_data" / "font" / "KhmerOS.ttf"
+BG_DIR = CURRENT_DIR.parent.parent / "example_data" / "bg"
+
+
+def test_dropout_vertical():
+    img = Image.new("RGBA", (100, 30), (255, 255, 255, 255))
+    out, _ = DropoutVertical(p=1, num_line=4, thickness=3).apply(img, BBox.from_size(img.size))
+
+    np_img = np.asarray(out)
+    changed = (np_img != 255).any(axis=2)
+    # whole columns are dropped, never the first or last column
+    cols = np.flatnonzero(changed.any(axis=0))
+    assert 3 <= len(cols) <= 12
+    assert cols[0] >= 1 and cols[-1] <= 98
+    lines = np_img[:, cols]
+    assert lines.max() <= 20
+    # every channel of a pixel has the same value
+    assert np.all(lines == lines[:, :, :1])
+
+
+def test_dropout_vertical_narrow_image():
+    for width in range(0, 6):
+        img = Image.new("LA", (width, 10), (255, 255))
+        out, _ = DropoutVertical(p=1, thickness=3).apply(img, BBox.from_size(img.size))
+        assert out.size == (width, 10)
+
+
+def test_render_effects_gray():
+    font_text = FontText(ImageFont.truetype(str(FONT_PATH), 30), "ភាសាខ្មែរ", str(FONT_PATH))
+    effects = [
+        DropoutRand(p=1),
+        DropoutHorizontal(p=1),
+        DropoutVertical(p=1),
+        Line(p=1),
+        Line(p=1, color_cfg=FixedTextColorCfg()),
+        Padding(p=1),
+        Curve(p=1),
+        Emboss(p=1, alpha=(0.9, 1.0)),
+        MotionBlur(p=1),
+    ]
+    for e in effects:
+        render = Render(
+            RenderCfg(bg_dir=BG_DIR, gray=True, height=32, render_effects=Effects(e))
+        )
+        # Render.__call__ retries forever on error
+        img, _ = Render.__call__.retry_with(stop=stop_after_attempt(1))(render, font_text)
+        assert img.ndim == 2 and img.shape[0] == 32, type(e).__name__
+
+
+def test_dropout_rand():
+    random.seed(0)
+    np.random.seed(0)
+    value = 200
+    for mode in ["LA", "RGBA", "L"]:
+        # only left half is visible
+        np_img = np.zeros((40, 100, len(mode)), dtype=np.uint8)
+        np_img[:, :50] = value
+        img = Image.fromarray(np_img[:, :, 0] if mode == "L" else np_img, mode)
+
+        changed_fractions, dropped_values = [], []
+        for _ in range(50):
+            out, _ = DropoutRand(p=1, dropout_p=(0.2, 0.4)).apply(
+                img.copy(), BBox.from_size(img.size)
+            )
+            out = np.asarray(out).reshape(40, 100, -1)
+            assert out.shape[2] == len(mode)
+            assert np.all(out[:, 50:] == 0)
+            changed = (out[:, :50] != value).any(axis=2)
+            changed_fractions.append(changed.mean())
+            dropped_values.append(out[:, :50][changed])
+
+        # same as baseline: random.randint(0, v) on every channel of 20% ~ 40% visible pixels
+        # (a pixel is unchanged if all its channels get v again)
+        assert 0.2 * (1 - 1 / (value + 1)) - 0.01 <= min(changed_fractions)
+        assert max(changed_fractions) <= 0.4
+        assert abs(np.mean(changed_fractions) - 0.3) < 0.035
+        dropped_values = np.concatenate(dropped_values)
+        assert dropped_values.max() <= value
+        assert abs(dropped_values.mean() - value / 2) < 5
+
+
+def curve_per_pixel(img, text_bbox, period, max_val):
+    # Curve.apply before remap maps were vectorized and cached
+    word_img = np.array(img)
+    h, w = word_img.shape[:2]
+    img_x = np.zeros((h, w), np.float32)
+    img_y = np.zeros((h, w), np.float32)
+    remap_y_min = text_bbox.top
+    remap_y_max = text_bbox.bottom
+    for y in range(h):
+        for x in range(w):
+            remaped_y = y + int(max_val * math.sin(2 * 3.14 * x / period))
+            if y == text_bbox.top and remaped_y < remap_y_min:
+                remap_y_min = remaped_y
+            if y == text_bbox.bottom and remaped_y > remap_y_max:
+                remap_y_max = remaped_y
+            img_y[y, x] = remaped_y
+            img_x[y, x] = x
+
+    dst = cv2.remap(word_img, img_x, img_y, cv2.INTER_CUBIC)
+    bbox = BBox(left=text_bbox.left, top=remap_y_min, right=text_bbox.right, bottom=remap_y_max)
+    return dst, bbox.offset((bbox.left, bbox.top), (0, 0))
+
+
+def test_curve_same_as_per_pixel():
+    rng = random.Random(0)
+    for i in range(50):
+        width, height = rng.randint(1, 300), rng.randint(1, 50)
+        mode = rng.choice(["LA", "RGBA"])
+        np_img = np.random.randint(0, 256, (height, width, len(mode)), dtype=np.uint8)
+        img = Image.fromarray(np_img, mode)
+        if i % 2:
+            bbox = BBox.from_size(img.size)
+        else:
+            bbox = BBox(0, rng.randint(0, height - 1), width, rng.randint(0, height - 1))
+        period = rng.choice([180, 90, 37.5])
+
+        for amplitude_step in [1e-12, 0.1]:
+            np.random.seed(i)
+            out, out_bbox = Curve(1, period, (1, 5), amplitude_step).apply(img, bbox)
+            np.random.seed(i)
+            max_val = round(np.random.uniform(1, 5) / amplitude_step) * amplitude_step
+
+            expected, expected_bbox = curve_per_pixel(img, bbox, period, max_val)
+            assert out.mode == mode
+            assert np.array_equal(np.asarray(out), expected)
+            assert out_bbox == expected_bbox
+
+
+def test_curve_cache_key():
+    # same period and amplitude on different sizes must not share remap maps
+    curve = Curve(1, 90, (2, 2.05), amplitude_step=1)
+    for width, height in [(100, 20), (100, 40), (60, 40), (100, 20)]:
+        np_img = np.random.randint(0, 256, (height, width, 2), dtype=np.uint8)
+        img = Image.fromarray(np_img, "LA")
+        out, out_bbox = curve.apply(img, BBox.from_size(img.size))
+        expected, expected_bbox = curve_per_pixel(img, BBox.from_size(img.size), 90, 2)
+        assert np.array_equal(np.asarray(out), expected)
+        assert out_bbox == expected_bbox
+
+    img_x, img_y, offsets = _get_remap_maps(100, 40, 90, 2)
+    assert img_x.shape == img_y.shape == (40, 100)
+    assert not img_y.flags.writeable
+    assert _get_remap_maps(100, 20, 90, 2)[1].shape == (20, 100)
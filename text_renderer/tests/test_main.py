@@ -0,0 +1,80 @@
+import queue
+import random
+import threading
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+from types import SimpleNamespace
+
+import numpy as np
+
+import main
+
+
+class FlakyRender:
+    """
+    Fake Render fails (raise or return None) with probability fail_p
+    """
+
+    def __init__(self, fail_p: float):
+        self.fail_p = fail_p
+        self.rng = random.Random(0)
+        self.lock = threading.Lock()
+        font = SimpleNamespace(size=10)
+        corpus = SimpleNamespace(
+            sample=lambda: SimpleNamespace(font=font, font_path="font.ttf", text="a")
+        )
+        self.render_config = SimpleNamespace(corpus=corpus)
+
+    def __call__(self, font_text):
+        with self.lock:
+            r = self.rng.random()
+        if r < self.fail_p / 2:
+            raise ValueError("render failed")
+        if r < self.fail_p:
+            return None
+        return np.zeros((2, 3), dtype=np.uint8), font_text.text
+
+
+def run_dispatch(monkeypatch, fail_p, num_image, chunk_size, max_retries):
+    data_queue = queue.Queue()
+    monkeypatch.setattr(main, "render", FlakyRender(fail_p), raising=False)
+    monkeypatch.setattr(main, "data_queue", data_queue)
+    monkeypatch.setattr(main, "encode_in_worker", False)
+
+    calls = []
+    generate_imgs = main.generate_imgs
+
+    def spy(indexes):
+        failed = generate_imgs(indexes)
+        calls.append((list(indexes), failed))
+        return failed
+
+    monkeypatch.setattr(main, "generate_imgs", spy)
+    with ThreadPool(4) as pool:
+        pending = main.dispatch(pool.imap_unordered, num_image, chunk_size, max_retries)
+    return pending, calls, data_queue.qsize()
+
+
+def test_dispatch_retry(monkeypatch):
+    num_image, chunk_size = 500, 7
+    pending, calls, put_count = run_dispatch(monkeypatch, 0.3, num_image, chunk_size, 10)
+
+    assert pending == []
+    assert all(len(indexes) <= chunk_size for indexes, _ in calls)
+    written = Counter(i for indexes, failed in calls for i in indexes if i not in failed)
+    # every index is written exactly once, failed ones are dispatched again
+    assert sorted(written) == list(range(num_image))
+    assert set(written.values()) == {1}
+    assert put_count == num_image
+    tried = Counter(i for indexes, _ in calls for i in indexes)
+    assert max(tried.values()) > 1
+
+
+def test_dispatch_retry_budget(monkeypatch):
+    num_image, max_retries = 20, 2
+    pending, calls, put_count = run_dispatch(monkeypatch, 1, num_image, 3, max_retries)
+
+    assert sorted(pending) == list(range(num_image))
+    assert put_count == 0
+    tried = Counter(i for indexes, _ in calls for i in indexes)
+    assert set(tried.values()) == {max_retries + 1}
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+
+from text_renderer.config import UniformPerspectiveTransformCfg
+from text_renderer.utils import utils
+from text_renderer.utils.math_utils import PerspectiveTransform, WarpMatrixBank, gen_warp_matrices
+
+
+def test_gen_warp_matrices_same_as_gen_warp_matrix():
+    cfg = UniformPerspectiveTransformCfg(30, 30, 5)
+    sizes = [(600, 30), (40, 32), (1, 1), (300, 64)]
+    xyz = [cfg.get_xyz() for _ in sizes]
+    M33s, out_sizes, pnts = gen_warp_matrices(sizes, xyz, cfg.scale, cfg.fovy)
+
+    for i, size in enumerate(sizes):
+        transformer = PerspectiveTransform(cfg)
+        transformer.x, transformer.y, transformer.z = xyz[i]
+        M33, _, _, _ = transformer.gen_warp_matrix(*size)
+        expected_pnts = transformer.transform_pnts(utils.size_to_pnts(size), M33)
+        x, y, w, h = cv2.boundingRect(expected_pnts)
+
+        # canvas is bounding rect with a margin for interpolation
+        offset = expected_pnts[0] - pnts[i][0]
+        assert np.all(np.abs(expected_pnts - offset - pnts[i]) <= 1)
+        assert np.all(offset <= [x, y])
+        assert np.all(out_sizes[i] >= [x + w, y + h] - offset)
+        assert np.all(out_sizes[i] <= [w + 8, h + 8])
+        # translated matrix maps image corners to the same points
+        translated_pnts = transformer.transform_pnts(utils.size_to_pnts(size), M33s[i])
+        assert np.abs(translated_pnts - pnts[i]).max() <= 1
+
+    M33, size, _ = transformer.sample((600, 30))
+    assert np.array_equal(M33, gen_warp_matrices([(600, 30)], [xyz[-1]], cfg.scale, cfg.fovy)[0][0])
+
+
+def test_warp_canvas_holds_warped_image():
+    np.random.seed(0)
+    cfg = UniformPerspectiveTransformCfg(30, 30, 5, bank_size=16)
+    bank = WarpMatrixBank(cfg, height=32)
+    transformer = PerspectiveTransform(cfg)
+    margin = 8
+    for size in [(600, 30), (40, 32), (300, 64), (7, 5)] * 5:
+        # opaque mask, text touches every edge
+        np_img = np.zeros((size[1], size[0], 2), dtype=np.uint8)
+        np_img[:, :, 1] = 255
+
+        for sample in [PerspectiveTransform(cfg).sample(size), bank.sample(size)]:
+            dst, _ = transformer.warp_perspective(np_img, sample)
+            M33, (width, height), _ = sample
+
+            # warp into a larger canvas, nothing is outside the tight canvas
+            M_translate = np.array([[1, 0, margin], [0, 1, margin], [0, 0, 1]], np.float32)
+            expected = cv2.warpPerspective(
+                np_img,
+                M_translate @ M33,
+                (width + 2 * margin, height + 2 * margin),
+                flags=cv2.INTER_CUBIC,
+                borderValue=(255, 0),
+            )
+            inner = expected[margin : margin + height, margin : margin + width]
+            assert expected[:, :, 1].sum(dtype=int) == inner[:, :, 1].sum(dtype=int)
+            assert np.array_equal(inner, dst)
+
+
+def test_warp_matrix_bank():
+    cfg = UniformPerspectiveTransformCfg(30, 30, 5, bank_size=16, bank_angle_step=1)
+    bank = WarpMatrixBank(cfg, height=32)
+    assert len(bank) == len(bank.xyz) * len(bank.aspects)
+    assert np.all(bank.xyz == np.round(bank.xyz))
+
+    for size in [(600, 30), (40, 32), (5000, 20), (3, 60)]:
+        M33, out_size, pnts = bank.sample(size)
+        transformed_pnts = PerspectiveTransform(cfg).transform_pnts(utils.size_to_pnts(size), M33)
+        # float32 rounding of the translated matrix
+        assert np.abs(transformed_pnts - pnts).max() <= 1
+        assert np.all(pnts.min(axis=0) >= 0)
+        assert np.all(pnts.max(axis=0) < out_size)
+
+
+def test_warp_matrix_bank_seed():
+    cfg = UniformPerspectiveTransformCfg(30, 30, 5, bank_size=16)
+    banks, samples = [], []
+    for seed in [1, 1, 2]:
+        np.random.seed(seed)
+        banks.append(WarpMatrixBank(cfg, height=32))
+        samples.append([banks[-1].sample((300, 30))[0] for _ in range(10)])
+
+    assert np.array_equal(banks[0].xyz, banks[1].xyz)
+    assert np.array_equal(banks[0].M33s, banks[1].M33s)
+    assert np.array_equal(samples[0], samples[1])
+    assert not np.array_equal(banks[0].M33s, banks[2].M33s)
@@ -0,0 +1,46 @@
+import os
+from pathlib import Path
+
+from text_renderer.config import RenderCfg, UniformPerspectiveTransformCfg
+from text_renderer.font_manager import get_font
+from text_renderer.render import Render
+from text_renderer.utils.font_text import FontText
+
+EXAMPLE_DIR = Path(os.path.abspath(os.path.dirname(__file__))).parent.parent / "example_data"
+
+
+def test_fit_font_size():
+    for font_name in ["KhmerOS.ttf", "KhmerOSmuollight.ttf"]:
+        font_path = str(EXAMPLE_DIR / "font" / font_name)
+        for font_size in [12, 30, 90]:
+            cfg = RenderCfg(
+                bg_dir=EXAMPLE_DIR / "bg",
+                gray=True,
+                height=32,
+                fit_font_size=True,
+                cluster_cache_size=1024 * 1024,
+            )
+            render = Render(cfg)
+            font_text = FontText(get_font(font_path, font_size), "ភាសាខ្មែរ ស្រស់ស្អាត", font_path)
+            _, _, _, text_mask = render.gen_single_corpus(font_text)
+
+            assert abs(text_mask.shape[0] - 32) <= 2
+            # fitted font is shared with font manager, and only the fitted size is rasterized
+            assert font_text.font is get_font(font_path, font_text.font.size)
+            assert {key[1] for key in render.cluster_cache._cache} == {font_text.font.size}
+
+
+def test_warp_bank_skips_angle_sampling(monkeypatch):
+    cfg = UniformPerspectiveTransformCfg(20, 20, 1.5, bank_size=16)
+    render = Render(
+        RenderCfg(bg_dir=EXAMPLE_DIR / "bg", gray=True, height=32, perspective_transform=cfg)
+    )
+
+    def get_xyz():
+        raise AssertionError("angles are sampled although warp bank is used")
+
+    monkeypatch.setattr(cfg, "get_xyz", get_xyz)
+    font_path = str(EXAMPLE_DIR / "font" / "KhmerOS.ttf")
+    font_text = FontText(get_font(font_path, 30), "ភាសាខ្មែរ", font_path)
+    img, _, _, text_mask = render.gen_single_corpus(font_text)
+    assert text_mask.shape[0] > 0
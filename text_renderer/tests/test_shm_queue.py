@@ -0,0 +1,61 @@
+import multiprocessing as mp
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("multiprocessing.shared_memory")
+
+from text_renderer.shm_queue import SharedMemoryQueue
+from text_renderer.utils.errors import PanicError
+
+
+def test_shm_queue():
+    height, width = 4, 10
+    q = SharedMemoryQueue(num_slots=2, slot_size=height * width)
+    try:
+        small = np.random.randint(0, 255, (height, width), dtype=np.uint8)
+        large = np.random.randint(0, 255, (height, width * 2), dtype=np.uint8)
+        q.put({"image": small, "label": "small"})
+        q.put({"image": large, "label": "large"})
+        q.put("kill")
+
+        m = q.get()
+        assert m["label"] == "small"
+        assert np.array_equal(m["image"], small)
+        # image in slot is not copied
+        assert m["image"].base is not None
+
+        m = q.get()
+        assert m["label"] == "large"
+        assert np.array_equal(m["image"], large)
+
+        assert q.get() == "kill"
+        del m
+    finally:
+        q.close()
+
+
+def read_one(q):
+    q.get()
+
+
+def test_shm_queue_reader_exited():
+    ctx = mp.get_context("spawn")
+    q = SharedMemoryQueue(num_slots=1, slot_size=4, poll_interval=0.05, ctx=ctx)
+    try:
+        reader = ctx.Process(target=read_one, args=(q,))
+        reader.start()
+        q.watch_readers([reader])
+        q.put({"image": np.zeros(4, dtype=np.uint8)})
+        reader.join()
+        assert reader.exitcode == 0
+
+        # reader closed the queue when exiting, so its slot is free again
+        q.put({"image": np.zeros(4, dtype=np.uint8)})
+        start = time.time()
+        with pytest.raises(PanicError):
+            q.put({"image": np.zeros(4, dtype=np.uint8)})
+        assert time.time() - start < 5
+    finally:
+        q.close()
@@ -0,0 +1,147 @@
+import re
+import threading
+import typing
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+if typing.TYPE_CHECKING:
+    from text_renderer.utils.font_text import FontText
+
+# Khmer orthographic syllable: base consonant/independent vowel followed by subscript consonants
+# (COENG + consonant), dependent vowels and signs. Other chars are single char clusters.
+CLUSTER_PATTERN = re.compile(
+    "[\u1780-\u17B3](?:\u17D2[\u1780-\u17B3]|[\u17B4-\u17D1\u17D3\u17DD])*|.", re.S
+)
+
+
+def split_clusters(text: str) -> List[str]:
+    return CLUSTER_PATTERN.findall(text)
+
+
+def render_mask(
+    font, text: str
+) -> Tuple[np.ndarray, Tuple[int, int], Tuple[int, int, int, int]]:
+    """
+    Returns:
+        mask: uint8 coverage mask of text
+        offset: same as font.getoffset(text)
+        bbox: (left, top, right, bottom) of non-zero pixels in mask, (0, 0, 0, 0) if empty
+    """
+    core_mask, offset = font.getmask2(text, "L")
+    bbox = core_mask.getbbox()
+    # wrap the core image to read it as numpy array
+    mask = np.asarray(Image.Image()._new(core_mask))
+    return mask, offset, bbox if bbox is not None else (0, 0, 0, 0)
+
+
+def mask_bbox(mask: np.ndarray) -> Tuple[int, int, int, int]:
+    """
+    Same as PIL getbbox, (0, 0, 0, 0) if mask is empty
+    """
+    xs = np.flatnonzero(mask.any(axis=0))
+    if xs.size == 0:
+        return 0, 0, 0, 0
+    ys = np.flatnonzero(mask.any(axis=1))
+    return int(xs[0]), int(ys[0]), int(xs[-1]) + 1, int(ys[-1]) + 1
+
+
+class ClusterCache:
+    """
+    LRU cache of rendered text clusters (Khmer syllables, single char for other scripts),
+    keyed by (font_path, font_size, cluster). A line is composed by blitting cached cluster
+    masks at their pen positions instead of rendering the whole line.
+
+    If the sum of cluster advances differs from the advance of the whole line
+    (e.g. kerning between clusters), the line is rendered as a whole.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+
+        Parameters
+        ----------
+        max_bytes : int
+            Max bytes of cached masks, least recently used clusters are dropped
+        """
+        self.max_bytes = max_bytes
+        # (font_path, font_size, cluster) -> (mask, offset, advance)
+        self._cache = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total != 0 else 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4),
+            "fallbacks": self.fallbacks,
+            "clusters": len(self._cache),
+            "bytes": self._nbytes,
+        }
+
+    def rasterize(
+        self, font_text: "FontText"
+    ) -> Tuple[np.ndarray, Tuple[int, int], Tuple[int, int, int, int]]:
+        """
+        Same output as :meth:`~text_renderer.utils.font_text.FontText.rasterize`
+        """
+        font = font_text.font
+        clusters = split_clusters(font_text.text)
+        if len(clusters) == 0:
+            return render_mask(font, font_text.text)
+
+        parts = []
+        pen = 0.0
+        for cluster in clusters:
+            mask, offset, advance = self._get(font, font_text.font_path, cluster)
+            parts.append((int(round(pen)) + offset[0], offset[1], mask))
+            pen += advance
+
+        if abs(pen - font.getlength(font_text.text)) >= 0.5:
+            self.fallbacks += 1
+            return render_mask(font, font_text.text)
+
+        x0 = min(x for x, _, _ in parts)
+        y0 = min(y for _, y, _ in parts)
+        x1 = max(x + m.shape[1] for x, _, m in parts)
+        y1 = max(y + m.shape[0] for _, y, m in parts)
+        line_mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        for x, y, m in parts:
+            # FreeType glyphs are merged by max when rendering a line
+            dst = line_mask[y - y0 : y - y0 + m.shape[0], x - x0 : x - x0 + m.shape[1]]
+            np.maximum(dst, m, out=dst)
+
+        return line_mask, (x0, y0), mask_bbox(line_mask)
+
+    def _get(self, font, font_path: str, cluster: str):
+        key = (font_path, font.size, cluster)
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return item
+            self.misses += 1
+
+        mask, offset, _ = render_mask(font, cluster)
+        item = (mask, offset, font.getlength(cluster))
+
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = item
+                self._nbytes += mask.nbytes
+                while self._nbytes > self.max_bytes and len(self._cache) > 1:
+                    _, (old_mask, _, _) = self._cache.popitem(last=False)
+                    self._nbytes -= old_mask.nbytes
+        return item
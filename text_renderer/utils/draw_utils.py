@@ -1,28 +1,54 @@
 from typing import Tuple, Union
 
-from PIL import ImageDraw, Image
+from PIL import Image
 from PIL.Image import Image as PILImage
 import numpy as np
 
 from text_renderer.utils.font_text import FontText
+from text_renderer.utils.glyph_table import get_glyph_table
 
 
-def transparent_img(size: Tuple[int, int]) -> PILImage:
+def transparent_img(size: Tuple[int, int], mode: str = "RGBA") -> PILImage:
     """
 
     Args:
         size: (width, height)
+        mode: RGBA or LA
 
     Returns:
 
     """
+    if mode == "LA":
+        return Image.new("LA", (size[0], size[1]), (255, 0))
     return Image.new("RGBA", (size[0], size[1]), (255, 255, 255, 0))
 
 
+def color_for_mode(color: Tuple[int, ...], mode: str) -> Tuple[int, ...]:
+    """
+    Convert RGBA color to the color format of Pillow image mode, RGB is converted to
+    luminance the same way as Pillow convert("L").
+
+    Args:
+        color: RGBA or RGB
+        mode: image mode, RGBA/RGB/LA/L
+
+    Returns:
+        color used by ImageDraw on image of mode
+    """
+    if mode not in ("L", "LA") or len(color) < 3:
+        return color
+    r, g, b = color[:3]
+    gray = (r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16
+    if mode == "L":
+        return gray
+    return gray, color[3] if len(color) > 3 else 255
+
+
 def draw_text_on_bg(
     font_text: FontText,
     text_color: Tuple[int, int, int, int] = (0, 0, 0, 255),
     char_spacing: Union[float, Tuple[float, float]] = -1,
+    mode: str = "RGBA",
 ) -> PILImage:
     """
 
@@ -34,31 +60,26 @@ def draw_text_on_bg(
     char_spacing : Union[float, Tuple[float, float]]
         Draw character with spacing. If tuple, random choice between [min, max)
         Set -1 to disable
+    mode : str
+        RGBA, or LA to draw text with luminance of text_color for gray output
 
     Returns
     -------
         PILImage:
-            RGBA Pillow image with text on a transparent image
+            Pillow image of mode with text on a transparent image
     -------
 
     """
     if char_spacing == -1:
         if font_text.horizontal:
-            return _draw_text_on_bg(font_text, text_color)
+            return _draw_text_on_bg(font_text, text_color, mode)
         else:
             char_spacing = 0
 
-    chars_size = []
-    widths = []
-    heights = []
-
-    for c in font_text.text:
-        # _, _, w, h = font_text.font.getbbox(c)
-        # size = [w, h]
-        size = font_text.font.getsize(c)
-        chars_size.append(size)
-        widths.append(size[0])
-        heights.append(size[1])
+    glyph_table = get_glyph_table(font_text.font)
+    glyphs = [glyph_table[c] for c in font_text.text]
+    widths = [g.size[0] for g in glyphs]
+    heights = [g.size[1] for g in glyphs]
 
     if font_text.horizontal:
         width = sum(widths)
@@ -82,30 +103,135 @@ def draw_text_on_bg(
     else:
         height += sum(char_spacings[:-1])
 
-    text_mask = transparent_img((width, height))
-    draw = ImageDraw.Draw(text_mask)
+    # Compose cached glyph masks, same result as ImageDraw.text for each char
+    alpha = np.zeros((height, width), dtype=np.uint32)
+    ink = np.zeros((height, width), dtype=bool)
 
     c_x = 0
     c_y = 0
-
     if font_text.horizontal:
-        y_offset = font_text.offset[1]
-        for i, c in enumerate(font_text.text):
-            draw.text((c_x, c_y - y_offset), c, fill=text_color, font=font_text.font)
-            c_x += chars_size[i][0] + char_spacings[i]
+        c_y = -font_text.offset[1]
     else:
-        x_offset = font_text.offset[0]
-        for i, c in enumerate(font_text.text):
-            draw.text((c_x - x_offset, c_y), c, fill=text_color, font=font_text.font)
-            c_y += chars_size[i][1] + char_spacings[i]
-        text_mask = text_mask.rotate(90, expand=True)
+        c_x = -font_text.offset[0]
+
+    for i, glyph in enumerate(glyphs):
+        _blend_glyph(alpha, ink, glyph, c_x, c_y, text_color[3])
+        if font_text.horizontal:
+            c_x += glyph.size[0] + char_spacings[i]
+        else:
+            c_y += glyph.size[1] + char_spacings[i]
+
+    text_mask = _to_image_array(alpha.astype(np.uint8), ink, text_color, mode)
+    if not font_text.horizontal:
+        text_mask = np.rot90(text_mask)
+
+    return array_to_pil(np.ascontiguousarray(text_mask), mode)
+
+
+def _div255(x: np.ndarray) -> np.ndarray:
+    # DIV255 of Pillow, x is uint32
+    x += 128
+    return ((x >> 8) + x) >> 8
+
+
+def _blend_glyph(alpha: np.ndarray, ink: np.ndarray, glyph, x: int, y: int, a: int):
+    """
+    Blend glyph coverage into alpha/ink buffers at (x, y) + glyph.offset, clipped
+    to the buffers the same way ImageDraw.text does.
+    """
+    mask = glyph.mask
+    x += glyph.offset[0]
+    y += glyph.offset[1]
+    height, width = alpha.shape
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + mask.shape[1], width), min(y + mask.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return
 
+    m = mask[y0 - y : y1 - y, x0 - x : x1 - x].astype(np.uint32)
+    dst = alpha[y0:y1, x0:x1]
+    dst[...] = _div255(dst * (255 - m) + m * a)
+    ink[y0:y1, x0:x1] |= m != 0
+
+
+def _to_image_array(
+    alpha: np.ndarray, ink: np.ndarray, text_color: Tuple[int, int, int, int], mode: str
+) -> np.ndarray:
+    """
+    Text color on ink pixels, transparent white elsewhere. Shape (h, w, 4) for RGBA,
+    (h, w, 2) for LA
+    """
+    if mode == "LA":
+        text_mask = np.empty(alpha.shape + (2,), dtype=np.uint8)
+        text_mask[..., 0] = 255
+        text_mask[ink, 0] = color_for_mode(text_color, mode)[0]
+    else:
+        text_mask = np.empty(alpha.shape + (4,), dtype=np.uint8)
+        text_mask[...] = (255, 255, 255, 0)
+        text_mask[ink, :3] = text_color[:3]
+    text_mask[..., -1] = alpha
     return text_mask
 
 
+def array_to_pil(np_img: np.ndarray, mode: str) -> PILImage:
+    # Image.fromarray shares the numpy buffer and is readonly, effects modify pixels in place
+    return Image.frombytes(mode, (np_img.shape[1], np_img.shape[0]), np_img.tobytes())
+
+
+def composite_text_mask(
+    bg: np.ndarray, text_mask: np.ndarray, xy: Tuple[int, int]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Alpha blend text mask onto the region of bg at xy. Same result as cropping the region
+    with Pillow and pasting text mask on it with itself as mask, without creating
+    intermediate images.
+
+    Args:
+        bg: (H, W) L or (H, W, 4) RGBA background, not modified
+        text_mask: (h, w, 2) LA or (h, w, 4) RGBA text mask
+        xy: (left, top) of the region
+
+    Returns:
+        composite: new array of the same shape as the region
+        cropped_bg: view of the region in bg. If the region is out of bg, it is a copy
+            padded with 0 like Pillow crop
+    """
+    x, y = xy
+    height, width = text_mask.shape[:2]
+    cropped_bg = bg[y : y + height, x : x + width]
+    if cropped_bg.shape[:2] != (height, width):
+        padded = np.zeros((height, width) + bg.shape[2:], dtype=bg.dtype)
+        padded[: cropped_bg.shape[0], : cropped_bg.shape[1]] = cropped_bg
+        cropped_bg = padded
+
+    if bg.ndim == 2:
+        # LA is converted to L when pasted on L image
+        src, alpha = text_mask[..., 0], text_mask[..., 1]
+    else:
+        # Pillow blends every band with the alpha of the mask, alpha band included.
+        # a * 0x01010101 repeats alpha in the 4 bytes of each pixel, which is much faster
+        # than np.repeat or broadcasting over the band axis
+        src = text_mask
+        alpha = text_mask[..., 3].astype(np.uint32) * np.uint32(0x01010101)
+        alpha = alpha.view(np.uint8).reshape(text_mask.shape)
+
+    # bg * (255 - a) + src * a <= 255 * 255, fits in uint16
+    out = np.subtract(255, alpha, dtype=np.uint16)
+    out *= cropped_bg
+    tmp = np.multiply(src, alpha, dtype=np.uint16)
+    out += tmp
+    # in place DIV255
+    out += 128
+    np.right_shift(out, 8, out=tmp)
+    out += tmp
+    out >>= 8
+    return out.astype(np.uint8), cropped_bg
+
+
 def _draw_text_on_bg(
     font_text: FontText,
     text_color: Tuple[int, int, int, int] = (0, 0, 0, 255),
+    mode: str = "RGBA",
 ) -> PILImage:
     """
     Draw text
@@ -115,25 +241,21 @@ def _draw_text_on_bg(
     font_text : FontText
     text_color : RGBA
         Default is black
+    mode : str
+        RGBA or LA
 
     Returns
     -------
         PILImage:
-            RGBA Pillow image with text on a transparent image
+            Pillow image of mode with text on a transparent image
     """
-    text_width, text_height = font_text.size
-    text_mask = transparent_img((text_width, text_height))
-    draw = ImageDraw.Draw(text_mask)
+    mask, _, (left, _, right, _) = font_text.rasterize()
+    coverage = mask[:, left:right]
+    if coverage.size == 0:
+        return transparent_img((coverage.shape[1], coverage.shape[0]), mode)
 
-    xy = font_text.xy
+    # Same result as ImageDraw.text on transparent_img, without rendering text again
+    alpha = _div255(coverage.astype(np.uint32) * text_color[3]).astype(np.uint8)
+    text_mask = _to_image_array(alpha, coverage != 0, text_color, mode)
 
-    # TODO: figure out anchor
-    draw.text(
-        xy,
-        font_text.text,
-        font=font_text.font,
-        fill=text_color,
-        anchor=None,
-    )
-
-    return text_mask
+    return array_to_pil(text_mask, mode)
@@ -1,7 +1,16 @@
-from dataclasses import dataclass
+import typing
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
 
+import numpy as np
 from PIL.ImageFont import FreeTypeFont
 
+from text_renderer.utils.cluster_cache import render_mask
+from text_renderer.utils.glyph_table import get_glyph_table
+
+if typing.TYPE_CHECKING:
+    from text_renderer.utils.cluster_cache import ClusterCache
+
 
 @dataclass
 class FontText:
@@ -9,17 +18,50 @@ class FontText:
     text: str
     font_path: str
     horizontal: bool = True
+    # (mask, offset, bbox) cached by rasterize()
+    _raster: Optional[Tuple[np.ndarray, Tuple[int, int], Tuple[int, int, int, int]]] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def rasterize(
+        self, cluster_cache: "ClusterCache" = None
+    ) -> Tuple[np.ndarray, Tuple[int, int], Tuple[int, int, int, int]]:
+        """
+        Render text only once, mask and metrics are cached for xy, offset, size and drawing
+
+        Args:
+            cluster_cache: if not None, compose text from cached clusters
+
+        Returns:
+            mask: uint8 coverage mask of text, shape (height, width)
+            offset: same as font.getoffset(text)
+            bbox: (left, top, right, bottom) of non-zero pixels in mask, (0, 0, 0, 0) if empty
+        """
+        if self._raster is None:
+            if cluster_cache is not None:
+                self._raster = cluster_cache.rasterize(self)
+            else:
+                self._raster = render_mask(self.font, self.text)
+        return self._raster
+
+    def set_font(self, font: FreeTypeFont):
+        """
+        Change font (e.g. font size) of text, cached mask is dropped
+        """
+        self.font = font
+        self._raster = None
 
     @property
     def xy(self):
-        offset = self.font.getoffset(self.text)
-        # left, top, right, bottom = self.font.getmask(self.text).getbbox()
-        left, top, right, bottom = self.get_bbox(self.text)
+        _, offset, (left, top, right, bottom) = self.rasterize()
         return 0 - offset[0] - left, 0 - offset[1]
 
     @property
     def offset(self):
-        return self.font.getoffset(self.text)
+        if self.horizontal:
+            return self.rasterize()[1]
+        # same as font.getoffset(text) of Pillow < 10
+        return self.font.getbbox(self.text)[:2]
 
     @property
     def size(self) -> [int, int]:
@@ -30,20 +72,16 @@ class FontText:
             width, height
         """
         if self.horizontal:
-            offset = self.font.getoffset(self.text)
-            size = self.font.getsize(self.text)
-            width = size[0] - offset[0]
-            height = size[1] - offset[1]
-            
-            left, top, right, bottom = self.get_bbox(self.text)
-            
-            return right - left, height
+            mask, _, (left, top, right, bottom) = self.rasterize()
+            return right - left, mask.shape[0]
         else:
-            widths = [self.font.getsize(c)[0] - self.font.getoffset(c)[0] for c in self.text]
-            width = max(widths)
-            height = sum([self.font.getsize(c)[1] for c in self.text]) - self.font.getoffset(self.text[0])[1]
+            glyphs = [get_glyph_table(self.font)[c] for c in self.text]
+            width = max(g.size[0] - g.offset[0] for g in glyphs)
+            height = sum(g.size[1] for g in glyphs) - glyphs[0].offset[1]
             return height, width
-        
+
     def get_bbox(self, text):
+        if text == self.text:
+            return self.rasterize()[2]
         bbox = self.font.getmask(text).getbbox()
         return bbox if bbox is not None else (0, 0, 0, 0)
@@ -0,0 +1,73 @@
+import threading
+import weakref
+from typing import Dict, NamedTuple, Tuple
+
+import numpy as np
+from PIL.ImageFont import FreeTypeFont
+
+from text_renderer.utils.cluster_cache import render_mask
+
+
+class Glyph(NamedTuple):
+    # uint8 coverage mask of the char
+    mask: np.ndarray
+    # same as font.getoffset(c) of Pillow < 10
+    offset: Tuple[int, int]
+    # same as font.getsize(c) of Pillow < 10
+    size: Tuple[int, int]
+
+
+class GlyphTable:
+    """
+    Per character mask and metrics of one font (font file + font size), filled lazily.
+    Used by per-character drawing (char_spacing, vertical text) instead of calling
+    font.getsize/getoffset and rendering each char for every sample.
+
+    Use :func:`get_glyph_table` to get the table shared by all samples of a font.
+    """
+
+    def __init__(self, font: FreeTypeFont):
+        # the table is the value of a WeakKeyDictionary keyed by font,
+        # a strong reference would keep the font alive forever
+        self._font_ref = weakref.ref(font)
+        self._glyphs: Dict[str, Glyph] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, c: str) -> Glyph:
+        glyph = self._glyphs.get(c)
+        if glyph is None:
+            font = self.font
+            mask, offset, _ = render_mask(font, c)
+            left, top, right, bottom = font.getbbox(c)
+            # getsize() removed in Pillow 10 counts negative bearings in the size
+            size = (right - min(left, 0), bottom - min(top, 0))
+            glyph = Glyph(mask, tuple(offset), size)
+            with self._lock:
+                self._glyphs.setdefault(c, glyph)
+        return glyph
+
+    @property
+    def font(self) -> FreeTypeFont:
+        return self._font_ref()
+
+    def __len__(self):
+        return len(self._glyphs)
+
+
+_tables = weakref.WeakKeyDictionary()
+_tables_lock = threading.Lock()
+
+
+def get_glyph_table(font: FreeTypeFont) -> GlyphTable:
+    """
+    FreeTypeFont objects are cached per (font_path, font_size) by FontManager,
+    so the table is shared across samples and dropped with the font.
+    """
+    table = _tables.get(font)
+    if table is None:
+        with _tables_lock:
+            table = _tables.get(font)
+            if table is None:
+                table = GlyphTable(font)
+                _tables[font] = table
+    return table
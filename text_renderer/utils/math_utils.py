@@ -9,7 +9,6 @@ import math
 from PIL import Image
 
 from text_renderer.config import PerspectiveTransformCfg
-from text_renderer.utils import utils
 
 
 # http://planning.cs.uiuc.edu/node102.html
@@ -58,6 +57,185 @@ def get_rotate_matrix(x, y, z):
     return M_x * M_y * M_z
 
 
+def gen_warp_matrices(
+    sizes: np.ndarray, xyz: np.ndarray, scale: float, fovy: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized PerspectiveTransform.gen_warp_matrix for many image sizes and angles.
+    Matrices are translated so the transformed image starts at origin and can be
+    warped directly into its bounding rect.
+
+    :param sizes: (N, 2) (width, height) of images
+    :param xyz: (N, 3) rotation angles in degrees
+    :param scale: see PerspectiveTransformCfg
+    :param fovy: see PerspectiveTransformCfg
+    :return:
+        M33s: (N, 3, 3) float32
+        out_sizes: (N, 2) (width, height) of transformed images
+        pnts: (N, 4, 2) image corners after transform, same order as utils.size_to_pnts
+    """
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    n = sizes.shape[0]
+    width, height = sizes[:, 0], sizes[:, 1]
+
+    fVhalf = np.deg2rad(fovy / 2.0)
+    d = np.sqrt(width * width + height * height)
+    sideLength = scale * d / np.cos(fVhalf)
+    h = d / (2.0 * np.sin(fVhalf))
+    p = 1.0 / np.tan(fVhalf)
+
+    x, y, z = np.radians(np.asarray(xyz, dtype=np.float64).reshape(-1, 3)).T
+    cx, sx = np.cos(x), np.sin(x)
+    cy, sy = np.cos(y), np.sin(y)
+    cz, sz = np.cos(z), np.sin(z)
+
+    # Image is on plane z=0, so x, y, w rows of P * T * R (see gen_warp_matrix) only use
+    # the first two columns of R = M_x * M_y * M_z and become a homography
+    H = np.zeros((n, 3, 3))
+    H[:, 0, 0] = p * cy * cz
+    H[:, 0, 1] = -p * cy * sz
+    H[:, 1, 0] = p * (cx * sz + sx * sy * cz)
+    H[:, 1, 1] = p * (cx * cz - sx * sy * sz)
+    H[:, 2, 0] = cx * sy * cz - sx * sz
+    H[:, 2, 1] = -(sx * cz + cx * sy * sz)
+    # P[3, 3] is 1 in gen_warp_matrix
+    H[:, 2, 2] = h + 1.0
+
+    # image coordinate -> centered coordinate
+    C = np.tile(np.eye(3), (n, 1, 1))
+    C[:, :2, 2] = -sizes / 2.0
+    # normalized device coordinate -> (sideLength, sideLength) image
+    S = np.tile(np.eye(3), (n, 1, 1))
+    S[:, 0, 0] = S[:, 1, 1] = S[:, 0, 2] = S[:, 1, 2] = 0.5 * sideLength
+    M33s = S @ H @ C
+    M33s = (M33s / M33s[:, 2:, 2:]).astype(np.float32)
+
+    return translate_to_canvas(M33s, sizes)
+
+
+def translate_to_canvas(
+    M33s: np.ndarray, sizes: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Translate warp matrices so the whole warped image starts at origin. The canvas holds
+    the transformed rect [-2, width + 1] x [-2, height + 1], because cv2.INTER_CUBIC
+    spreads a pixel up to 2 pixels around it.
+
+    :param M33s: (N, 3, 3) float32 warp matrices
+    :param sizes: (N, 2) (width, height) of images
+    :return: see :func:`gen_warp_matrices`
+    """
+    sizes = np.asarray(sizes, dtype=np.float64).reshape(-1, 2)
+    n = sizes.shape[0]
+    M = M33s.astype(np.float64).transpose(0, 2, 1)
+
+    def transform(corners):
+        corners = np.concatenate([corners, np.ones((n, 4, 1))], axis=2) @ M
+        return corners[:, :, :2] / corners[:, :, 2:]
+
+    unit = np.array([[0, 0], [1, 0], [1, 1], [0, 1]])
+    support = transform(unit * (sizes[:, None, :] + 3) - 2)
+    x0y0 = np.floor(support.min(axis=1)).astype(int)
+    out_sizes = np.ceil(support.max(axis=1)).astype(int) - x0y0 + 1
+
+    # same order as utils.size_to_pnts, relative to canvas
+    pnts = transform(unit * sizes[:, None, :]) - x0y0[:, None, :]
+    pnts = pnts.astype(np.float32).astype(int)
+
+    M_translate = np.tile(np.eye(3, dtype=np.float32), (n, 1, 1))
+    M_translate[:, :2, 2] = -x0y0
+    M33s = M_translate @ M33s
+
+    return M33s, out_sizes, pnts
+
+
+class WarpMatrixBank:
+    """
+    Warp matrices precomputed for quantized angles and aspect ratio buckets of images
+    with a reference height, see bank_* options of PerspectiveTransformCfg.
+
+    A matrix of the bank is scaled to the real image size when sampled, so only image
+    corners are transformed per sample.
+    """
+
+    def __init__(self, cfg: PerspectiveTransformCfg, height: int = 32):
+        """
+
+        Parameters
+        ----------
+        cfg : PerspectiveTransformCfg
+        height : int
+            Reference height of images, e.g. RenderCfg.height
+        """
+        assert cfg.bank_size > 0 and cfg.bank_aspect_step > 0
+        self.height = height
+        self.aspect_step = cfg.bank_aspect_step
+
+        xyz = np.array([cfg.get_xyz() for _ in range(cfg.bank_size)], dtype=np.float64)
+        if cfg.bank_angle_step > 0:
+            xyz = np.unique(np.round(xyz / cfg.bank_angle_step) * cfg.bank_angle_step, axis=0)
+        self.xyz = xyz
+
+        self.aspects = np.arange(1, int(cfg.bank_max_aspect / self.aspect_step) + 1) * self.aspect_step
+        sizes = np.stack([self.aspects * height, np.full_like(self.aspects, height)], axis=1)
+
+        # (num_angles * num_aspects) matrices, angle major
+        M33s, _, _ = gen_warp_matrices(
+            np.tile(sizes, (len(xyz), 1)),
+            np.repeat(xyz, len(sizes), axis=0),
+            cfg.scale,
+            cfg.fovy,
+        )
+        self.M33s = M33s.reshape(len(xyz), len(sizes), 3, 3)
+
+    def __len__(self):
+        return self.M33s.shape[0] * self.M33s.shape[1]
+
+    def sample(self, size: Tuple[int, int]) -> Tuple[np.ndarray, Tuple[int, int], np.ndarray]:
+        """
+        Same output as PerspectiveTransform.sample
+        """
+        width, height = size
+        aspect_idx = int(round(width / height / self.aspect_step)) - 1
+        aspect_idx = min(max(aspect_idx, 0), self.M33s.shape[1] - 1)
+        M33 = self.M33s[np.random.randint(self.M33s.shape[0]), aspect_idx]
+
+        # image -> reference size -> warp -> scale back to image size
+        s = self.height / height
+        M33 = M33 * np.array([[1, 1, 1 / s], [1, 1, 1 / s], [s, s, 1]], dtype=np.float32)
+
+        M33s, out_sizes, pnts = translate_to_canvas(M33[None], [size])
+        M33, out_size, pnts = M33s[0], out_sizes[0], pnts[0]
+
+        return M33, (int(out_size[0]), int(out_size[1])), pnts
+
+
+def warp_perspective(np_img: np.ndarray, sample) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Warp (h, w, 2) LA or (h, w, 4) RGBA numpy image directly into the bounding rect of
+    transformed image corners
+
+    Args:
+        np_img:
+        sample: (M33, size, pnts) from PerspectiveTransform.sample(), sample_batch()
+            or WarpMatrixBank.sample()
+
+    Returns:
+        transformed numpy image and its corners
+    """
+    M33, (width, height), transformed_pnts = sample
+
+    dst = cv2.warpPerspective(
+        np_img,
+        M33,
+        (int(width), int(height)),
+        flags=cv2.INTER_CUBIC,
+        borderValue=(255, 0) if np_img.shape[2] == 2 else (255, 255, 255, 0),
+    )
+
+    return dst, transformed_pnts.copy()
+
+
 # https://stackoverflow.com/questions/17087446/how-to-calculate-perspective-transform-for-opencv-from-rotation-angles
 # https://nbviewer.jupyter.org/github/manisoftwartist/perspectiveproj/blob/master/perspective.ipynb
 # http://planning.cs.uiuc.edu/node102.html
@@ -75,52 +253,68 @@ class PerspectiveTransform(object):
         Returns:
             (width, height)
         """
-        width, height = size
-        _, _, _, text_box_pnts_transformed = self.gen_warp_matrix(width, height)
+        _, transformed_size, _ = self.sample(size)
+        return transformed_size
 
-        transformed_bbox = cv2.boundingRect(text_box_pnts_transformed)
-        bbox_width = transformed_bbox[2]
-        bbox_height = transformed_bbox[3]
+    def sample(self, size: Tuple[int, int]) -> Tuple[np.ndarray, Tuple[int, int], np.ndarray]:
+        """
+        Build warp matrix of this transformer for image size
 
-        return int(bbox_width), int(bbox_height)
+        Args:
+            size: (width, height)
+
+        Returns:
+            M33: warp matrix, transformed image starts at origin
+            size: (width, height) of transformed image
+            pnts: (4, 2) image corners after transform
+        """
+        M33s, sizes, pnts = gen_warp_matrices(
+            [size], [(self.x, self.y, self.z)], self.scale, self.fovy
+        )
+        return M33s[0], (int(sizes[0][0]), int(sizes[0][1])), pnts[0]
 
-    def do_warp_perspective(self, pil_img):
+    @staticmethod
+    def sample_batch(
+        cfg: PerspectiveTransformCfg, sizes: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
+        Sample angles from cfg for each size and build all warp matrices at once.
 
         Args:
-            pil_img:
+            cfg: PerspectiveTransformCfg
+            sizes: (N, 2) (width, height) of images
 
         Returns:
+            see :func:`gen_warp_matrices`, each item can be passed to do_warp_perspective
+        """
+        xyz = [cfg.get_xyz() for _ in range(len(sizes))]
+        return gen_warp_matrices(sizes, xyz, cfg.scale, cfg.fovy)
 
+    def do_warp_perspective(self, pil_img, sample=None):
         """
-        text_box_pnts = utils.size_to_pnts(pil_img.size)
-        img = np.array(pil_img).astype(np.uint8)
+        Warp image directly into the bounding rect of transformed image corners
 
-        dst = cv2.warpPerspective(
-            img,
-            self.M33,
-            (self.sl, self.sl),
-            flags=cv2.INTER_CUBIC,
-            borderValue=(255, 255, 255, 0),
-        )
-        transformed_pnts = self.transform_pnts(text_box_pnts, self.M33)
+        Args:
+            pil_img:
+            sample: (M33, size, pnts) from sample() or sample_batch(),
+                if None, call sample() with size of pil_img
 
-        transformed_text_box = cv2.boundingRect(transformed_pnts)
-        transformed_text_box = list(transformed_text_box)
-        dst = Image.fromarray(dst)
-        dst = dst.crop(
-            [
-                transformed_text_box[0],
-                transformed_text_box[1],
-                transformed_text_box[0] + transformed_text_box[2],
-                transformed_text_box[1] + transformed_text_box[3],
-            ]
-        )
+        Returns:
+            transformed image and its corners
+        """
+        dst, transformed_pnts = self.warp_perspective(np.asarray(pil_img), sample)
+        return Image.fromarray(dst), transformed_pnts
 
-        transformed_pnts[:, 0] -= transformed_text_box[0]
-        transformed_pnts[:, 1] -= transformed_text_box[1]
+    def warp_perspective(self, np_img: np.ndarray, sample=None):
+        """
+        Same as do_warp_perspective, for (h, w, 2) LA or (h, w, 4) RGBA numpy image
 
-        return dst, transformed_pnts
+        Returns:
+            transformed numpy image and its corners
+        """
+        if sample is None:
+            sample = self.sample((np_img.shape[1], np_img.shape[0]))
+        return warp_perspective(np_img, sample)
 
     def transform_pnts(self, pnts, M33):
         """
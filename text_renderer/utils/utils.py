@@ -124,6 +124,26 @@ def random_xy_offset(small_size, big_size) -> Tuple[int, int]:
     return x_offset, y_offset
 
 
+def relative_xy_offset(small_size, big_size, placement: Tuple[float, float]) -> Tuple[int, int]:
+    """
+    Get left-top point for putting a small rect in a large rect at relative position.
+    random_xy_offset with placement from random.random() has the same distribution.
+
+    Args:
+        small_size: (width, height)
+        big_size: (width, height)
+        placement: (x, y) in [0, 1), (0, 0) is left-top
+
+    Returns:
+
+    """
+    x_max_offset = max(big_size[0] - small_size[0], 0)
+    y_max_offset = max(big_size[1] - small_size[1], 0)
+    x_offset = min(int(placement[0] * (x_max_offset + 1)), x_max_offset)
+    y_offset = min(int(placement[1] * (y_max_offset + 1)), y_max_offset)
+    return x_offset, y_offset
+
+
 def size_to_pnts(size) -> np.ndarray:
     """
     获得图片 size 的四个角点 (4,2)
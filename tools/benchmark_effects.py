@@ -0,0 +1,44 @@
+"""
+Time effects on text masks of growing height, e.g:
+
+    python tools/benchmark_effects.py --effects=DropoutVertical,DropoutRand --heights=32,128,512
+"""
+import timeit
+
+import fire
+import numpy as np
+from PIL import Image
+
+from text_renderer import effect
+from text_renderer.utils.bbox import BBox
+
+
+def benchmark(
+    effects=("DropoutVertical",),
+    heights=(32, 64, 128, 256, 512),
+    width: int = 600,
+    mode: str = "LA",
+    number: int = 100,
+):
+    if isinstance(effects, str):
+        effects = effects.split(",")
+    if isinstance(heights, int):
+        heights = (heights,)
+
+    print(f"{'effect':<20}" + "".join(f"{f'h={h}':>12}" for h in heights))
+    for name in effects:
+        e = getattr(effect, name)(p=1)
+        row = f"{name:<20}"
+        for height in heights:
+            np_img = np.random.randint(0, 256, (height, width, len(mode)), dtype=np.uint8)
+            img = Image.fromarray(np_img, mode)
+            bbox = BBox.from_size(img.size)
+            # effects are applied on the same image again and again, copying it in every
+            # run would hide the cost of cheap effects
+            cost = timeit.timeit(lambda: e.apply(img, bbox), number=number) / number
+            row += f"{cost * 1000:>10.3f}ms"
+        print(row)
+
+
+if __name__ == "__main__":
+    fire.Fire(benchmark)
@@ -3,7 +3,7 @@ import cv2
 
 import fire
 from tqdm import tqdm
-from text_renderer.dataset import LmdbDataset
+from text_renderer.dataset import LmdbDataset, ShardedDataset
 
 
 def hello(name="World"):
@@ -18,7 +18,8 @@ def lmdb2img(input: str, output: str, num: int = -1):
     else:
         os.makedirs(output)
 
-    with LmdbDataset(input) as db:
+    dataset_cls = ShardedDataset if ShardedDataset.is_sharded(input) else LmdbDataset
+    with dataset_cls(input) as db:
         count = db.read_count()
 
         if num == -1 or num > count: